@@ -12,6 +12,23 @@ import subprocess
 import signal
 import shutil
 import re
+import tempfile
+import hashlib
+import errno
+import sqlite3
+import itertools
+import threading
+import time
+import resource
+from xml.sax.saxutils import quoteattr
+import multiprocessing
+import math
+import sys
+import fcntl
+import difflib
+import random
+import ctypes
+import Queue
 
 # Default argument values
 DEFAULT_COMPILER_PATH = './ifj20'
@@ -23,11 +40,116 @@ DEFAULT_GO_INTERPRETER = 'go'
 DEFAULT_IFJCODE_INTERPRETER = './ic20int'
 DEFAULT_GO_INCLUDE = './ifj20.go'
 DEFAULT_TMP_DIR = './tmp'
+DEFAULT_JOBS = 1
+DEFAULT_CACHE_DIR = './cache'
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_MAX_OUTPUT = 16
+DEFAULT_GO_BATCH = 0
+DEFAULT_INTERPRETER_BACKEND = 'spawn'
+DEFAULT_INTERPRETER_POOL = 1
+DEFAULT_BENCHMARK_RUNS = 10
+DEFAULT_BENCHMARK_WARMUP = 2
+DEFAULT_BENCHMARK_THRESHOLD = 10
+DEFAULT_SHARD_FILE = './shard-%d.jsonl'
+DEFAULT_REDUCE_FILE = './reduced.go'
+DEFAULT_FUZZ_COUNT = 100
+DEFAULT_FUZZ_DIR = './fuzz'
+DEFAULT_TOP = 5
 
 # Tmp file names
 TMP_TEMPLATE_FILE_NAME = 'ifj20.go'
 TMP_GO_FILE_NAME = 'in.go'
-TMP_IFJCODE_FILE_NAME = 'out.ifjcode'
+TMP_GO_BINARY_NAME = 'in'
+TMP_IFJCODE_SUFFIX = '.ifjcode'
+TMP_WORKER_DIR_PREFIX = 'worker-'
+TMP_GO_BATCH_DIR = 'go-batch'
+TMP_GO_BATCH_DRIVER_NAME = 'driver'
+TMP_FUZZ_DIR = 'fuzz'
+TMP_FUZZ_CACHE_PREFIX = 'fuzz-cache-'
+TMP_REDUCE_CACHE_PREFIX = 'reduce-cache-'
+
+# Prefix of identifiers of a test in batched go program (followed by test number in batch)
+GO_BATCH_PREFIX = 'ifjbatch'
+
+# Tokens of go source (comments, literals, identifiers, braces, other characters)
+GO_TOKEN = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:[^"\\\n]|\\.)*"|`[^`]*`|\'(?:[^\'\\\n]|\\.)*\'|[A-Za-z_][A-Za-z_0-9]*|\s+|.', re.S)
+
+# Size of chunks in which outputs of child processes are read and compared
+OUTPUT_CHUNK_SIZE = 65536
+
+# Normalisation rules of outputs compared with go (name -> pattern, replacement). Rules are applied to both outputs,
+# they must not change number of lines (outputs are normalised in chunks of whole lines)
+OUTPUT_RULES = {'float' : (re.compile(r'(0x[0-9a-fA-F\.]+p[+-])0([0-9])'), r'\1\2'),
+                'trailing-space' : (re.compile(r'[ \t]+$', re.M), '')}
+
+# Rules applied to outputs of all tests (other rules are enabled by normalize pragma in test header)
+DEFAULT_OUTPUT_RULES = ['float']
+
+# Lines shown in log around the first difference of outputs (before it, after it) and maximal shown length of a line
+DIFF_CONTEXT = 3
+DIFF_LINES = 10
+DIFF_LINE_LENGTH = 200
+
+# Levels of test code reduction in the order they are tried (function: functions except main,
+# block: statements with a block including the whole block, line: lines without braces)
+REDUCE_LEVELS = ['function', 'block', 'line']
+
+# Limits of random programs: bounds of absolute values of numbers and lengths of strings (in variables and in parameters),
+# maximal nesting of statements and number of functions
+FUZZ_BOUNDS = {'int' : 2 ** 40, 'float64' : 2.0 ** 40, 'string' : 200, 'bool' : 1}
+FUZZ_PARAM_BOUNDS = {'int' : 2 ** 20, 'float64' : 2.0 ** 20, 'string' : 50, 'bool' : 1}
+FUZZ_DEPTH = 2
+FUZZ_FUNCTIONS = 3
+
+# Builtin functions of ifj20.go used in random programs (name, parameters, results, bounds of results), bound None is bound of the first argument
+FUZZ_BUILTINS = [('substr', ['string', 'int', 'int'], ['string', 'int'], [None, 1]),
+                 ('ord', ['string', 'int'], ['int', 'int'], [255, 1]),
+                 ('chr', ['int'], ['string', 'int'], [1, 1]),
+                 ('int2float', ['int'], ['float64'], [None]),
+                 ('float2int', ['float64'], ['int'], [None])]
+
+# Number of random programs generated at once in fuzz mode
+FUZZ_ROUND = 100
+
+# Version of parsed test headers stored in test index (headers parsed by older versions are parsed again)
+TEST_HEADER_VERSION = 2
+
+# Ways to run ifjcode interpreter (spawn: new process for every test with program in a scratch file in memory (memfd),
+# prefork: processes started ahead of time that get program through a pipe). Prefork still starts one process
+# for every test, it only starts it earlier, so it is not faster than spawn. It checks that results of the
+# interpreter do not depend on the way its program is passed (see --interpreter-cross-check).
+INTERPRETER_BACKENDS = ['spawn', 'prefork']
+
+# RAM-backed directories for scratch files when anonymous files in memory (memfd) are not available
+# (tmp directory is used if none of them is usable)
+SCRATCH_DIRS = ['/dev/shm']
+
+# Cache directory names
+CACHE_GO_BINARY_DIR = 'go-bin'
+CACHE_GOLDEN_FILE = 'golden.sqlite'
+CACHE_INCREMENTAL_FILE = 'incremental.json'
+CACHE_TEST_INDEX_FILE = 'index.json'
+CACHE_HISTORY_FILE = 'history.json'
+CACHE_TOOLCHAIN_FILE = 'toolchains.json'
+
+# Interval of checking watched files for changes in watch mode (seconds)
+WATCH_INTERVAL = 0.5
+
+# Stages whose processes are limited by resource limits (go compiler and go program are not limited, go runtime
+# can not reserve its address space under memory limit and outputs of go program are stored as expected outputs)
+LIMITED_STAGES = ['compiler', 'interpreter']
+
+# Stages whose resource usage is compared in summary (go is only a reference)
+MEASURED_STAGES = ['compiler', 'interpreter']
+
+# Number of last verdicts of each test kept in history
+HISTORY_VERDICTS = 10
+
+# Verdicts of tests that did not pass
+FAILURE_VERDICTS = ['FAILED', 'TIMEOUT', 'OUTPUT_LIMIT']
+
+# Supported formats of results report (format -> default report file)
+REPORT_FORMATS = {'jsonl' : './report.jsonl', 'junit' : './report.xml'}
 
 # List of extensions
 EXTENSIONS = ['BOOLTHEN', 'BASE', 'FUNEXP', 'MULTIVAL', 'UNARY']
@@ -37,19 +159,62 @@ test_index = 0
 test_id = ""
 log = None
 logEnable = True
-process = None
+logBuffer = []
+testStages = {}
+outputLimit = None
+stageLimits = {}
+interpreterPool = []
+golden = None
+libc = None
+ifjcodeWriter = None
+compilerMemo = {}
+startTime = time.time()
 
+# Log messages are buffered per test and written by the main process in test order
 def Log (message):
     if logEnable:
+        logBuffer.append(message)
+
+def FlushLog (messages):
+    for message in messages:
         if log is None:
             print(message)
         else:
             log.write(message + '\n')
 
+def OpenLog (args):
+    global log
+    global logEnable
+    if args.log_none:
+        logEnable = False
+    elif not args.log_output:
+        log = open(args.log_file, 'w')
+
+def CloseLog ():
+    global log
+    if log is not None:
+        log.close()
+        log = None
+
 # Function to parse command line arguments
-def ParseArgs ():
+def ParseArgs (command=None):
     # Define parser
-    parser = argparse.ArgumentParser(description="run tests for IFJ20 project")
+    if command == 'reduce':
+        parser = argparse.ArgumentParser(prog='testsuite.py reduce', description='reduce code of failing IFJ20 test to the smallest program that still fails the same way')
+        parser.add_argument('test', help='failing test file or test scenario ("file:input") to be reduced (all other test selection arguments are ignored)')
+        parser.add_argument('--verdict', choices=FAILURE_VERDICTS, help='verdict that reduced test must keep. default: Verdict of the test')
+        parser.add_argument('--any-error', action='store_true', help='reduced test must keep only the verdict, not the error message of the test (allows reduction to a different failure)')
+        parser.add_argument('--reduce-file', default=DEFAULT_REDUCE_FILE, help='path to the file where reduced test is written (if file already exists, it will be overwritten). default: ' + DEFAULT_REDUCE_FILE)
+    elif command == 'fuzz':
+        parser = argparse.ArgumentParser(prog='testsuite.py fuzz', description='run random IFJ20 programs (using only implemented extensions) as tests and save the failing ones as new tests (test selection arguments are ignored)')
+        parser.add_argument('--fuzz-count', default=DEFAULT_FUZZ_COUNT, type=int, help='number of random programs. default: ' + str(DEFAULT_FUZZ_COUNT) + ' (0 runs programs until interrupted by Ctrl+C)')
+        parser.add_argument('--fuzz-seed', type=int, help='seed of the first random program (following programs use following seeds). default: Current time')
+        parser.add_argument('--fuzz-dir', default=DEFAULT_FUZZ_DIR, help='path to the directory where failing programs are saved as tests. default: ' + DEFAULT_FUZZ_DIR)
+    else:
+        parser = argparse.ArgumentParser(description="run tests for IFJ20 project", epilog='other commands (see "testsuite.py COMMAND --help"): '
+                                         '"testsuite.py merge FILE..." combines results of shards (--shard), '
+                                         '"testsuite.py reduce TEST" reduces code of a failing test to the smallest program that still fails the same way, '
+                                         '"testsuite.py fuzz" runs random IFJ20 programs as tests and saves the failing ones')
 
     # Define arguments for mode selection
     group = parser.add_mutually_exclusive_group()
@@ -71,19 +236,67 @@ def ParseArgs ():
     group.add_argument('--log-none', '-ln', action='store_true', help='do not print logs to output or a file')
     parser.add_argument('--log-success-output', '-ls', action='store_true', help='log interpret output from successfull tests')
     parser.add_argument('--save-ifjcode-all', '-a', action='store_true', help='stores compiler results (ifjcode files) for all tests (not only failed ones)')
-    parser.add_argument('--timeout', '-t', default=DEFAULT_TIMEOUT, type=int, help='specify maximum timeout for each test in seconds (required to detect infinite run errors). defult = ' + str(DEFAULT_TIMEOUT))
+    parser.add_argument('--timeout', '-t', default=DEFAULT_TIMEOUT, type=int, help='specify maximum timeout for each test stage (compiler, interpreter, go) in seconds (required to detect infinite run errors). defult = ' + str(DEFAULT_TIMEOUT))
+    parser.add_argument('--timeout-compile', type=int, help='maximum timeout of IFJ20 compiler in seconds. default: value of --timeout')
+    parser.add_argument('--timeout-interpret', type=int, help='maximum timeout of IFJcode interpreter in seconds. default: value of --timeout')
+    parser.add_argument('--timeout-go', type=int, help='maximum timeout of go compiler and compiled go program in seconds. default: value of --timeout')
+    parser.add_argument('--max-output', default=DEFAULT_MAX_OUTPUT, type=int, help='maximum size of standard and error output of each test stage in MB (test exceeding this limit ends with OUTPUT_LIMIT result). default: ' + str(DEFAULT_MAX_OUTPUT))
+    parser.add_argument('--limit-cpu', type=int, help='maximum cpu time of each process of compiler and interpreter in seconds (test exceeding this limit ends with TIMEOUT result). default: No limit')
+    parser.add_argument('--limit-memory', type=int, help='maximum address space of each process of compiler and interpreter in MB. default: No limit')
+    parser.add_argument('--limit-file-size', type=int, help='maximum size of files written by each process of compiler and interpreter in MB. default: No limit')
+    parser.add_argument('--top', default=DEFAULT_TOP, type=int, help='number of tests with the most cpu time and memory used by compiler and interpreter listed in summary. default: ' + str(DEFAULT_TOP))
+    parser.add_argument('--report', choices=sorted(REPORT_FORMATS.keys()), help='write machine readable results (verdict, exit codes and times of each stage) of every test as it finishes')
+    parser.add_argument('--report-file', help='path to the report file (if file already exists, it will be overwritten). default: ' + ', '.join(fmt + ': ' + REPORT_FORMATS[fmt] for fmt in sorted(REPORT_FORMATS.keys())))
+    parser.add_argument('--jobs', '-j', default=DEFAULT_JOBS, type=int, help='number of tests run in parallel (each worker process uses its own tmp directory). default: ' + str(DEFAULT_JOBS))
+    parser.add_argument('--prioritize', '-p', action='store_true', help='run tests in order given by their history: recently failed tests first, then tests with changing results, then others (longest first when tests are run in parallel, shortest first otherwise)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--fail-fast', '-ff', action='store_true', help='stop testing after the first test that does not pass (same as --max-failures 1)')
+    group.add_argument('--max-failures', default=0, type=int, help='stop testing after this number of tests that do not pass. default: 0 (never stop)')
+    parser.add_argument('--shard', help='run only i-th of N parts of selected tests, written as "i/N" (tests of the same file are always in the same part). example: "2/4"')
+    parser.add_argument('--shard-history', help='path to the history file (written by "testsuite.py merge --history-file") used to balance shards by durations of tests, all shards must use the same file. default: Tests are split by hash of their paths')
+    parser.add_argument('--shard-file', help='path to the file where results and logs of the shard are written (shard files are combined by "testsuite.py merge FILE..."). default: ' + DEFAULT_SHARD_FILE.replace('%d', 'I'))
+    parser.add_argument('--verbose', '-v', action='store_true', help='print time spent by parsing arguments, processing tests and checking toolchains before tests are run')
+    parser.add_argument('--watch', '-w', action='store_true', help='after tests are run, keep watching compiler, interpreter and selected tests and run again tests affected by their changes (until interrupted by Ctrl+C)')
     parser.add_argument('--output-folder', '-o', default=DEFAULT_OUTPUT_FOLDER, help='path to the folder where compiler output (IFJ20code language programs) is stored for every test that fails on interpretation or checking (if folder already exists, it will be deleted). default: ' + DEFAULT_OUTPUT_FOLDER)
 
+    # Define arguments for benchmark mode
+    parser.add_argument('--benchmark', '-b', action='store_true', help='benchmark mode measures times of compiler and interpreter on each test repeatedly instead of checking outputs (tests are run one at a time)')
+    parser.add_argument('--benchmark-runs', default=DEFAULT_BENCHMARK_RUNS, type=int, help='number of measured runs of each test in benchmark mode. default: ' + str(DEFAULT_BENCHMARK_RUNS))
+    parser.add_argument('--benchmark-warmup', default=DEFAULT_BENCHMARK_WARMUP, type=int, help='number of unmeasured runs of each test before measured runs in benchmark mode. default: ' + str(DEFAULT_BENCHMARK_WARMUP))
+    parser.add_argument('--benchmark-baseline', help='path to results of previous benchmark (created by --benchmark-save), benchmark fails if any test is slower than in baseline')
+    parser.add_argument('--benchmark-save', help='path to the file where benchmark results are saved (to be used as baseline later)')
+    parser.add_argument('--benchmark-threshold', default=DEFAULT_BENCHMARK_THRESHOLD, type=float, help='allowed slowdown against baseline in percents. default: ' + str(DEFAULT_BENCHMARK_THRESHOLD))
+
     # Define other arguments
     parser.add_argument('--go-interpreter', default=DEFAULT_GO_INTERPRETER, help='command to execute native go interpreter for output checking. default: ' + DEFAULT_GO_INTERPRETER)
     parser.add_argument('--ifjcode-interpreter', default=DEFAULT_IFJCODE_INTERPRETER, help='command to execute IFJ20code interpreter for compiler output interpretation. default: ' + DEFAULT_IFJCODE_INTERPRETER)
     parser.add_argument('--go-include-file', default=DEFAULT_GO_INCLUDE, help='path to the file that is required to be included in go programs to execute ifj language. default: ' + DEFAULT_GO_INCLUDE)
+    parser.add_argument('--interpreter-backend', default=DEFAULT_INTERPRETER_BACKEND, choices=INTERPRETER_BACKENDS, help='how ifjcode interpreter is run. spawn: new interpreter process for every test, program is passed as /dev/fd/N of an anonymous file in memory (memfd, or removed file in /dev/shm or tmp directory when memfd is not available). prefork: interpreter processes are started ahead of time and get program through a pipe (one process is still started for every test, so it is not faster than spawn, it is meant for checking that results do not depend on the way program is passed). default: ' + DEFAULT_INTERPRETER_BACKEND)
+    parser.add_argument('--interpreter-pool', default=DEFAULT_INTERPRETER_POOL, type=int, help='number of interpreter processes started ahead of time by each worker with prefork backend. default: ' + str(DEFAULT_INTERPRETER_POOL))
+    parser.add_argument('--interpreter-cross-check', action='store_true', help='run interpreter with both backends and fail tests with different results')
     parser.add_argument('--tmp-dir', default=DEFAULT_TMP_DIR, help='path to a temp directory that will be created to store temp files for tests. default: ' + DEFAULT_TMP_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='path to a directory where state is kept between runs: compiled go programs, stored go outputs, results of incremental runs, index of test headers, history of test results and checked toolchains. default: ' + DEFAULT_CACHE_DIR)
+    parser.add_argument('--go-batch', default=DEFAULT_GO_BATCH, type=int, help='build go programs of up to this number of tests together into one program before tests are run (tests that can not be built together are built separately). default: ' + str(DEFAULT_GO_BATCH) + ' (disabled)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--refresh-golden', action='store_true', help='always run tests on native go interpreter and replace go outputs stored in cache directory')
+    group.add_argument('--no-go-needed', action='store_true', help='do not use native go interpreter at all, outputs are checked only against go outputs stored in cache directory by previous runs')
+    parser.add_argument('--incremental', '-i', action='store_true', help='run only tests that changed (or whose compiler, interpreter or settings changed) since their last successful run. Results are stored in cache directory')
+    parser.add_argument('--force', '-f', action='store_true', help='run all selected tests even in incremental mode (results are still stored for next incremental run)')
+    parser.add_argument('--cache-size', default=DEFAULT_CACHE_SIZE, type=int, help='maximum size of compiled go programs in cache directory in MB (least recently used programs are removed). default: ' + str(DEFAULT_CACHE_SIZE))
 
     # Parse arguments from command line
-    args = parser.parse_args()
+    args = parser.parse_args(sys.argv[1:] if command is None else sys.argv[2:])
+    args.command = command
 
     # Argument postprrocessing
+    if command == 'reduce':
+        args.select = args.test.split(':')[0]
+        args.select_file = None
+        if not os.path.isfile(args.select) or not args.select.endswith('.go'):
+            raise Exception('Reduced test \'' + args.select + '\' is not a valid test file')
+        if os.path.isdir(args.reduce_file):
+            raise Exception('There is a directory with the same name as specified reduce file \'' + args.reduce_file + '\'')
+
     if not args.mode_compile_only and not args.mode_interpret_only and not args.mode_all:
         print('setting default mode --mode-all')
         args.mode_all = True
@@ -92,6 +305,7 @@ def ParseArgs ():
         if not os.path.isfile(args.select_file):
             raise Exception('Test selection file\'' + args.select_file + '\' does not exists')
         print('parsing test selection file')
+        args.select = []
         with open(args.select_file) as f:
             while True:
                 line = f.readline()
@@ -108,6 +322,7 @@ def ParseArgs ():
 
     if not os.path.isfile(args.compiler):
         raise Exception('The path \'' + args.compiler + '\' is not a valid compiler executable')
+    args.compiler_fingerprint = FileFingerprint(args.compiler)
 
     if args.extensions != '':
         print('parsing extensions')
@@ -128,15 +343,160 @@ def ParseArgs ():
 
     if args.timeout <= 0:
         raise Exception('Value of timeout must be greater then zero, but is \'' + str(args.timeout) + '\'')
+    for stage in ['compile', 'interpret', 'go']:
+        if getattr(args, 'timeout_' + stage) is None:
+            setattr(args, 'timeout_' + stage, args.timeout)
+        elif getattr(args, 'timeout_' + stage) <= 0:
+            raise Exception('Value of ' + stage + ' timeout must be greater then zero, but is \'' + str(getattr(args, 'timeout_' + stage)) + '\'')
+
+    if args.interpreter_pool <= 0:
+        raise Exception('Size of interpreter pool must be greater then zero, but is \'' + str(args.interpreter_pool) + '\'')
+
+    if args.go_batch < 0:
+        raise Exception('Value of go batch must not be negative, but is \'' + str(args.go_batch) + '\'')
+
+    if args.max_output <= 0:
+        raise Exception('Value of max output must be greater then zero, but is \'' + str(args.max_output) + '\'')
+    for limit in ['cpu', 'memory', 'file_size']:
+        if getattr(args, 'limit_' + limit) is not None and getattr(args, 'limit_' + limit) <= 0:
+            raise Exception('Value of ' + limit.replace('_', ' ') + ' limit must be greater then zero, but is \'' + str(getattr(args, 'limit_' + limit)) + '\'')
+    if args.top < 0:
+        raise Exception('Number of top tests must not be negative, but is \'' + str(args.top) + '\'')
+
+    if args.report is not None and args.report_file is None:
+        args.report_file = REPORT_FORMATS[args.report]
+    if args.report_file is not None and os.path.isdir(args.report_file):
+        raise Exception('There is a directory with the same name as specified report file \'' + args.report_file + '\'')
+
+    if args.jobs <= 0:
+        raise Exception('Number of jobs must be greater then zero, but is \'' + str(args.jobs) + '\'')
+
+    if args.max_failures < 0:
+        raise Exception('Number of max failures must not be negative, but is \'' + str(args.max_failures) + '\'')
+    if args.fail_fast:
+        args.max_failures = 1
+
+    if args.shard is not None:
+        match = re.match(r'^([0-9]+)/([0-9]+)$', args.shard)
+        if match is None:
+            raise Exception('Shard must be written as \'i/N\', but is \'' + args.shard + '\'')
+        args.shard, args.shards = int(match.group(1)), int(match.group(2))
+        if args.shard < 1 or args.shard > args.shards:
+            raise Exception('Shard number must be between 1 and number of shards, but is \'' + str(args.shard) + '/' + str(args.shards) + '\'')
+        if args.shard_file is None:
+            args.shard_file = DEFAULT_SHARD_FILE % args.shard
+        if os.path.isdir(args.shard_file):
+            raise Exception('There is a directory with the same name as specified shard file \'' + args.shard_file + '\'')
+        if args.shard_history is not None and not os.path.isfile(args.shard_history):
+            raise Exception('Shard history \'' + args.shard_history + '\' is not a valid file')
+    elif args.shard_file is not None or args.shard_history is not None:
+        raise Exception('Shard file and shard history can be used only together with --shard')
+
+    if args.benchmark:
+        if args.benchmark_runs <= 0:
+            raise Exception('Number of benchmark runs must be greater then zero, but is \'' + str(args.benchmark_runs) + '\'')
+        if args.benchmark_warmup < 0:
+            raise Exception('Number of benchmark warm-up runs must not be negative, but is \'' + str(args.benchmark_warmup) + '\'')
+        if args.benchmark_threshold < 0:
+            raise Exception('Benchmark threshold must not be negative, but is \'' + str(args.benchmark_threshold) + '\'')
+        if args.benchmark_baseline is not None and not os.path.isfile(args.benchmark_baseline):
+            raise Exception('Benchmark baseline \'' + args.benchmark_baseline + '\' is not a valid file')
+        if args.jobs > 1:
+            print('benchmark runs tests one at a time, ignoring --jobs')
+            args.jobs = 1
+
+    if args.watch and (args.benchmark or args.shard is not None):
+        raise Exception('Watch mode can not be used together with benchmark or shards')
+    if command is not None and (args.watch or args.benchmark or args.shard is not None):
+        raise Exception('Command ' + command + ' can not be used together with watch mode, benchmark or shards')
+
+    if command == 'fuzz':
+        if args.fuzz_count < 0:
+            raise Exception('Number of random programs must not be negative, but is \'' + str(args.fuzz_count) + '\'')
+        if args.fuzz_seed is None:
+            args.fuzz_seed = int(time.time())
+        if args.no_go_needed:
+            raise Exception('Random programs have no stored go outputs, --no-go-needed can not be used')
+        if os.path.isfile(args.fuzz_dir):
+            raise Exception('There is a file with the same name as specified fuzz directory \'' + args.fuzz_dir + '\'')
 
     if os.path.isfile(args.output_folder):
         raise Exception('There is a file with the same name as specified output folder \'' + args.output_folder + '\'')
+    # Old output folders are moved aside and removed in background, so tests do not wait for them
+    parent, name = os.path.split(os.path.abspath(args.output_folder))
+    old = [os.path.join(parent, f) for f in os.listdir(parent) if f.startswith(name + '.old-')]
     if os.path.isdir(args.output_folder):
         print('removing old output folder \'' + args.output_folder + '\'')
-        shutil.rmtree(args.output_folder)
+        old.append(tempfile.mkdtemp(prefix=name + '.old-', dir=parent))
+        os.rename(args.output_folder, os.path.join(old[-1], name))
+    if old != []:
+        threading.Thread(target=lambda: [shutil.rmtree(path, True) for path in old]).start()
     print('creating output folder \'' + args.output_folder + '\'')
     os.mkdir(args.output_folder)
 
+    # Toolchains are checked only when tests need them (see ProbeToolchains)
+    args.go_version = None
+    if args.no_go_needed:
+        print('go interpreter is not used, outputs are checked against stored go outputs only')
+
+    if not os.path.isfile(args.go_include_file):
+        raise Exception('The path \'' + args.go_include_file + '\' is not a valid go include file')
+    with open(args.go_include_file, 'r') as f:
+        args.go_include_code = f.read()
+
+    if args.cache_size < 0:
+        raise Exception('Value of cache size must not be negative, but is \'' + str(args.cache_size) + '\'')
+    if os.path.isfile(args.cache_dir):
+        raise Exception('There is a file with the same name as specified cache directory \'' + args.cache_dir + '\'')
+    if not os.path.isdir(os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR)):
+        print('creating cache directory  \'' + args.cache_dir + '\'')
+        os.makedirs(os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR))
+
+    if os.path.isfile(args.tmp_dir):
+        raise Exception('There is a file with the same name as specified tmp directory \'' + args.tmp_dir + '\'')
+    if os.path.isdir(args.tmp_dir):
+        print('using exesting tmp directory  \'' + args.tmp_dir + '\'')
+    else:
+        print('creating tmp directory  \'' + args.tmp_dir + '\'')
+        os.mkdir(args.tmp_dir)
+
+    return args
+
+# Path of executable that is run by given command (None if it does not exist)
+def FindExecutable(command):
+    if os.sep in command:
+        return command if os.path.isfile(command) else None
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+# Result of toolchain check is stored in cache directory and reused until its binary changes (command -> [path, mtime, size, result])
+def ProbeToolchain(command, probe, args):
+    path = FindExecutable(command)
+    if path is None:
+        return probe()
+    stat = os.stat(path)
+    stamp = [os.path.realpath(path), stat.st_mtime, stat.st_size]
+    cacheFile = os.path.join(args.cache_dir, CACHE_TOOLCHAIN_FILE)
+    cache = {}
+    if os.path.isfile(cacheFile):
+        try:
+            with open(cacheFile, 'r') as f:
+                cache = json.load(f)
+        except ValueError:
+            print('ignoring corrupted toolchain file \'' + cacheFile + '\'')
+    if command in cache and cache[command][:3] == stamp:
+        return cache[command][3]
+    result = probe()
+    cache[command] = stamp + [result]
+    with open(cacheFile + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.rename(cacheFile + '.tmp', cacheFile)
+    return result
+
+def ProbeGo(args):
     print('checking go interpreter')
     try:
         output = subprocess.check_output([args.go_interpreter, 'version'])
@@ -144,8 +504,9 @@ def ParseArgs ():
         raise Exception('Go interpreter is not valid. Command: \'' + args.go_interpreter + ' version\' couldn\'t be executed. Reason: ' + str(ex))
     if output[:11] != 'go version ':
         raise Exception('Go interpreter is not valid. Command: \'' + args.go_interpreter + ' version\' didn\'t produce correct output')
-    print('go interpreter found in version \'' + output[11:-1] + '\'')
+    return output[11:-1]
 
+def ProbeIfjcodeInterpreter(args):
     print('checking ifjcode interpreter')
     try:
         output = subprocess.check_output([args.ifjcode_interpreter, '--help'])
@@ -153,190 +514,741 @@ def ParseArgs ():
         raise Exception('Ifjcode interpreter is not valid. Command: \'' + args.ifjcode_interpreter + ' --help\' couldn\'t be executed. Reason:' + str(ex))
     if output[:7] != 'BUILD: ':
         raise Exception('Ifjcode interpreter is not valid. Command: \'' + args.ifjcode_interpreter + ' --help\' didn\'t produce correct output')
-    print('ifjcode interpreter found')
-
-    if not os.path.isfile(args.go_include_file):
-        raise Exception('The path \'' + args.go_include_file + '\' is not a valid go include file')
-
-    if os.path.isfile(args.tmp_dir):
-        raise Exception('There is a file with the same name as specified tmp directory \'' + args.tmp_dir + '\'')
-    if os.path.isdir(args.tmp_dir):
-        print('using exesting tmp directory  \'' + args.tmp_dir + '\'')
-    else:
-        print('creating tmp directory  \'' + args.tmp_dir + '\'')
-        os.mkdir(args.tmp_dir)
-    shutil.copyfile(args.go_include_file, os.path.join(args.tmp_dir, TMP_TEMPLATE_FILE_NAME))
+    return True
 
-    return args
+# Check only toolchains needed by selected tests in selected mode (compile only mode needs none of them)
+def ProbeToolchains(tests, args):
+    if tests == [] or args.mode_compile_only:
+        return
+    ProbeToolchain(args.ifjcode_interpreter, lambda: ProbeIfjcodeInterpreter(args), args)
+    print('ifjcode interpreter found')
+    if args.mode_all and not args.no_go_needed and not args.benchmark and not all(test['nogo'] for test in tests):
+        args.go_version = ProbeToolchain(args.go_interpreter, lambda: ProbeGo(args), args)
+        print('go interpreter found in version \'' + args.go_version + '\'')
 
 def ProcessTests(args):
-    def ProcessTestFile(path):
-        result = {}
-        result['name'] = path
-        result['nogo'] = False
-        result['code'] = ''
-        result['compiler'] = []
-        result['interpret'] = []
-        result['extensions+'] = []
-        result['extensions-'] = []
-        result['scenarios'] = []
-        with open(path, 'r') as f:
-            while True:
-                line = f.readline().strip()
-                if line.startswith('//compiler '):
-                    if result['compiler'] != []:
-                        raise Exception('compiler pragma present multiple times in test header of test file \'' + path + '\'')
-                    for item in line.split()[1:]:
-                        result['compiler'].append(int(item))
-                elif line.startswith('//nogo'):
-                    if result['nogo']:
-                        raise Exception('nogo pragma present multiple times in test header of test file \'' + path + '\'')
-                    result['nogo'] = True
-                elif line.startswith('//interpret '):
-                    if result['interpret'] != []:
-                        raise Exception('interpret pragma present multiple times in test header of test file \'' + path + '\'')
-                    for item in line.split()[1:]:
-                        result['interpret'].append(int(item))
-                elif line.startswith('//extensions+ '):
-                    if result['extensions+'] != []:
-                        raise Exception('extensions+ pragma present multiple times in test header of test file \'' + path + '\'')
-                    for item in line.split()[1:]:
-                        result['extensions+'].append(int(item))
-                elif line.startswith('//extensions- '):
-                    if result['extensions-'] != []:
-                        raise Exception('extensions- pragma present multiple times in test header of test file \'' + path + '\'')
-                    for item in line.split()[1:]:
-                        result['extensions-'].append(int(item))
-                elif line.startswith('//input '):
-                    scenario = line.split()
-                    if (len(scenario) != 2):
-                        raise Exception('input pragma does not contain a file')
-                    inputFile = os.path.join(os.path.dirname(path), scenario[1])
-                    if not os.path.isfile(inputFile):
-                        raise Exception('input file \'' + inputFile + '\' in scenario test \'' + path + '\' is not valid file')
-                    with open(inputFile, 'r') as inputF:
-                        content = inputF.read()
-                    result['scenarios'].append((scenario[1], content))
-                elif line == '//':
-                    content = ''
-                    while True:
-                        line = f.readline()
-                        if line == '':
-                            break
-                        content += line
-                    result['code'] = content
-                    break
-                elif line.startswith('// '):
-                    continue
-                else:
-                    raise Exception('invalid test header in test file \'' + path + '\'')
+    # Parse header of a test file, test code is not kept (it is loaded only when the test is run)
+    def ParseTestHeader(path):
+        header = {}
+        header['nogo'] = False
+        header['compiler'] = []
+        header['interpret'] = []
+        header['extensions+'] = []
+        header['extensions-'] = []
+        header['inputs'] = []
+        header['normalize'] = []
+        with open(path, 'rb') as f:
+            content = f.read()
+        offset = 0
+        while True:
+            end = content.find('\n', offset)
+            end = len(content) if end == -1 else end + 1
+            line = content[offset:end].strip()
+            offset = end
+            if line.startswith('//compiler '):
+                if header['compiler'] != []:
+                    raise Exception('compiler pragma present multiple times in test header of test file \'' + path + '\'')
+                for item in line.split()[1:]:
+                    header['compiler'].append(int(item))
+            elif line.startswith('//nogo'):
+                if header['nogo']:
+                    raise Exception('nogo pragma present multiple times in test header of test file \'' + path + '\'')
+                header['nogo'] = True
+            elif line.startswith('//interpret '):
+                if header['interpret'] != []:
+                    raise Exception('interpret pragma present multiple times in test header of test file \'' + path + '\'')
+                for item in line.split()[1:]:
+                    header['interpret'].append(int(item))
+            elif line.startswith('//extensions+ '):
+                if header['extensions+'] != []:
+                    raise Exception('extensions+ pragma present multiple times in test header of test file \'' + path + '\'')
+                header['extensions+'] = line.split()[1:]
+            elif line.startswith('//extensions- '):
+                if header['extensions-'] != []:
+                    raise Exception('extensions- pragma present multiple times in test header of test file \'' + path + '\'')
+                header['extensions-'] = line.split()[1:]
+            elif line.startswith('//input '):
+                scenario = line.split()
+                if (len(scenario) != 2):
+                    raise Exception('input pragma does not contain a file')
+                header['inputs'].append(scenario[1])
+            elif line.startswith('//normalize '):
+                if header['normalize'] != []:
+                    raise Exception('normalize pragma present multiple times in test header of test file \'' + path + '\'')
+                header['normalize'] = line.split()[1:]
+            elif line == '//':
+                header['code_offset'] = offset
+                header['code_hash'] = hashlib.sha256(content[offset:]).hexdigest()
+                break
+            elif line.startswith('// '):
+                continue
+            else:
+                raise Exception('invalid test header in test file \'' + path + '\'')
 
-        for ext in result['extensions+']:
+        for ext in header['extensions+']:
             if ext not in EXTENSIONS:
                 raise Exception('Unrecognized extension \'' + ext + '\' in test header of test file \'' + path + '\'')
-        for ext in result['extensions-']:
+        for ext in header['extensions-']:
             if ext not in EXTENSIONS:
                 raise Exception('Unrecognized extension \'' + ext + '\' in test header of test file \'' + path + '\'')
-        if result['scenarios'] != [] and (result['compiler'] != [] or result['interpret'] != []):
+        for rule in header['normalize']:
+            if rule not in OUTPUT_RULES:
+                raise Exception('Unrecognized output rule \'' + rule + '\' in test header of test file \'' + path + '\'')
+        if header['inputs'] != [] and (header['compiler'] != [] or header['interpret'] != []):
             raise Exception('invalid combination of input and compiler/interpret pragma in test header of test file \'' + path + '\'')
-        if result['compiler'] == []:
-            result['compiler'].append(0)
-        if result['interpret'] == []:
-            result['interpret'].append(0)
-        if result['code'] == '':
+        if header['compiler'] == []:
+            header['compiler'].append(0)
+        if header['interpret'] == []:
+            header['interpret'].append(0)
+        if offset == len(content):
             raise Exception('No test code loaded from test file \'' + path + '\'')
-        
-        if result['scenarios'] != []:
-            results = []
-            for scenario in result['scenarios']:
-                newTest = {}
-                newTest['name'] = result['name'] + ':' + scenario[0]
-                newTest['nogo'] = result['nogo']
-                newTest['code'] = result['code']
-                newTest['compiler'] = result['compiler']
-                newTest['extensions+'] = result['extensions+']
-                newTest['extensions-'] = result['extensions-']
-                newTest['interpret'] = result['interpret']
-                newTest['input'] = scenario[1]
-                results.append(newTest)
+        return header
+
+    # Headers are parsed again only if modification time or size of the test file changed
+    # (index is keyed by normalised path, so the same file selected in different ways has one entry)
+    def ProcessTestFile(path):
+        stat = os.stat(path)
+        key = os.path.normpath(path)
+        seen.add(key)
+        entry = index.get(key)
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size and entry[3:] == [TEST_HEADER_VERSION]:
+            header = entry[2]
         else:
-            result['input'] = ''
-            results = [result]
+            header = ParseTestHeader(path)
+            index[key] = [stat.st_mtime, stat.st_size, header, TEST_HEADER_VERSION]
+            changed[0] = True
+
+        result = {}
+        result['name'] = path
+        result['path'] = path
+        result['code_offset'] = header['code_offset']
+        result['code_hash'] = header['code_hash']
+        result['nogo'] = header['nogo']
+        result['compiler'] = header['compiler']
+        result['interpret'] = header['interpret']
+        result['extensions+'] = header['extensions+']
+        result['extensions-'] = header['extensions-']
+        result['normalize'] = header['normalize']
+        result['input_file'] = None
+        if header['inputs'] == []:
+            return [result]
 
+        results = []
+        for scenario in header['inputs']:
+            inputFile = os.path.join(os.path.dirname(path), scenario)
+            if not os.path.isfile(inputFile):
+                raise Exception('input file \'' + inputFile + '\' in scenario test \'' + path + '\' is not valid file')
+            newTest = dict(result)
+            newTest['name'] = path + ':' + scenario
+            newTest['input_file'] = inputFile
+            results.append(newTest)
         return results
 
+    # Scenario tests with the same file and input names would have the same output file names
+    def AddTests(tests):
+        for test in tests:
+            split = test['name'].split(':')
+            if len(split) > 1:
+                key = (os.path.basename(split[0]), split[1])
+                if key in names:
+                    raise Exception('Test files \'' + names[key] + '\' and \'' + test['name'] + '\' have the same name')
+                names[key] = test['name']
+            result.append(test)
+
+    indexFile = os.path.join(args.cache_dir, CACHE_TEST_INDEX_FILE)
+    index = {}
+    if os.path.isfile(indexFile):
+        try:
+            with open(indexFile, 'r') as f:
+                index = json.load(f)
+        except ValueError:
+            print('ignoring corrupted test index file \'' + indexFile + '\'')
+    changed = [False]
+    seen = set()
+    names = {}
     result = []
     for item in args.select:
         if os.path.isfile(item) and item.endswith('.go'):
-            result += ProcessTestFile(item)
+            AddTests(ProcessTestFile(item))
         elif os.path.isdir(item):
             for directory, _, files in os.walk(item):
                 for f in files:
                     if f.endswith('.go'):
-                        result += ProcessTestFile(os.path.join(directory, f))
+                        AddTests(ProcessTestFile(os.path.join(directory, f)))
         else:
             raise Exception('\'' + item + '\' is not a test file or a test directory')
 
-    for i in range(len(result)):
-        for j in range(i+1, len(result)):
-            split_a = result[i]['name'].split(':')
-            split_b = result[j]['name'].split(':')
-            if os.path.basename(split_a[0]) == os.path.basename(split_b[0]):
-                if len(split_a) > 1 and len(split_b) > 1 and split_a[1] == split_b[1]:
-                    raise Exception('Test files \'' + result[i]['name'] + '\' and \'' + result[j]['name'] + '\' have the same name')
+    # Entries of test files that were deleted from selected directories are removed
+    for root in [os.path.normpath(item) for item in args.select if os.path.isdir(item)]:
+        for key in list(index.keys()):
+            if root == os.curdir:
+                inside = not os.path.isabs(key) and key.split(os.sep)[0] != os.pardir
+            else:
+                inside = key.startswith(root + os.sep)
+            if inside and key not in seen:
+                del index[key]
+                changed[0] = True
 
+    if changed[0]:
+        with open(indexFile + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.rename(indexFile + '.tmp', indexFile)
 
     print('Total tests selected: \'' + str(len(result)) + '\'')
     return result
 
-# Run test on native go interpreter
-def RunGo(test_code, program_input, interpret, tmp_dir):
-    global process
-    # Execute test on native go interpreter
+# Stage of a test exceeded its timeout
+class TestTimeout(RuntimeError):
+    pass
+
+# Stage of a test produced more output than allowed
+class TestOutputLimit(RuntimeError):
+    pass
+
+# Kill process together with all processes it started
+def KillProcessGroup(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+# Add exit code, times and memory of a process to the stage of current test (go stage consists of build and run)
+def RecordStage(stage, exit_code, wall_time, cpu_time, cached=False, usage=None, rss_floor=0):
+    info = testStages.setdefault(stage, {'wall_time' : 0.0, 'cpu_time' : 0.0, 'user_time' : 0.0, 'sys_time' : 0.0, 'max_rss' : 0, 'rss_floor' : 0, 'cached' : cached})
+    info['exit_code'] = exit_code
+    info['wall_time'] += wall_time
+    info['cpu_time'] += cpu_time
+    if usage is not None:
+        info['user_time'] += usage.ru_utime
+        info['sys_time'] += usage.ru_stime
+        # Peak of resident set size in kB is kept across exec, so it is the peak of the program only if it is above
+        # the size of the testsuite process that forked it (otherwise the program used at most that much)
+        info['max_rss'] = max(info['max_rss'], usage.ru_maxrss)
+        info['rss_floor'] = max(info['rss_floor'], rss_floor)
+
+# Current resident set size of the testsuite process in kB (its peak if the current size is not available)
+def RunnerRss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Resource limits of processes of each limited stage (stage -> list of resource and its soft and hard limit)
+def StageLimits(args):
+    limits = []
+    if args.limit_cpu is not None:
+        # Process gets SIGXCPU on soft limit and SIGKILL one second later if it survives
+        limits.append((resource.RLIMIT_CPU, (args.limit_cpu, args.limit_cpu + 1)))
+    if args.limit_memory is not None:
+        limits.append((resource.RLIMIT_AS, (args.limit_memory * 1024 * 1024, args.limit_memory * 1024 * 1024)))
+    if args.limit_file_size is not None:
+        limits.append((resource.RLIMIT_FSIZE, (args.limit_file_size * 1024 * 1024, args.limit_file_size * 1024 * 1024)))
+    return dict((stage, limits) for stage in LIMITED_STAGES)
+
+# Wait for the process and return its resource usage (unlike RUSAGE_CHILDREN it does not include other children)
+def WaitProcess(process):
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as ex:
+            if ex.errno != errno.EINTR:
+                raise
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return usage
+
+# Read output of a child process in chunks, the process group is killed when output exceeds limit
+def ReadOutput(stream, sink, limit, exceeded, process):
+    size = 0
+    while True:
+        chunk = os.read(stream.fileno(), OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if limit is not None and size > limit:
+            # Rest of the output is only drained until the killed process closes it
+            if not exceeded.is_set():
+                exceeded.set()
+                KillProcessGroup(process)
+            continue
+        sink(chunk)
+
+def WriteInput(stream, data):
+    try:
+        stream.write(data)
+        stream.close()
+    except (IOError, OSError):
+        # Process ended without reading its whole input
+        pass
+
+def SetCloexec(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+def WriteProgram(fd, data):
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    except OSError:
+        # Interpreter ended without reading its whole program
+        pass
+    finally:
+        os.close(fd)
+
+# Start command in its own process group with given resource limits. Pipes of the process are not inherited by other processes,
+# so closing its input is always seen by the process (even if it waits in a pool for a long time).
+def Spawn(cmd, limits=None):
+    def Prepare():
+        os.setsid()
+        for limit, value in limits or []:
+            resource.setrlimit(limit, value)
+    rss_floor = RunnerRss()
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=Prepare)
+    process.rss_floor = rss_floor
+    for stream in [process.stdin, process.stdout, process.stderr]:
+        SetCloexec(stream.fileno())
+    return process
+
+# Execute command in its own process group, the whole group is killed when timeout expires
+# or when it exceeds output limit (error output can be passed to a sink instead of being stored)
+def Execute(cmd, program_input, timeout, stage, stderr_sink=None):
+    return Collect(Spawn(cmd, stageLimits.get(stage)), program_input, timeout, stage, stderr_sink)
+
+# Pass input to a started process and collect its results (program can be passed to an interpreter
+# waiting for it on a pipe as a pair of pipe and program code)
+def Collect(process, program_input, timeout, stage, stderr_sink=None, program=None):
+    start_time = time.time()
+    expired = threading.Event()
+    exceeded = threading.Event()
+    def Expire():
+        expired.set()
+        KillProcessGroup(process)
+    timer = threading.Timer(timeout, Expire)
+    timer.start()
+    capture_out = []
+    capture_err = []
+    threads = [threading.Thread(target=WriteInput, args=(process.stdin, program_input)),
+               threading.Thread(target=ReadOutput, args=(process.stdout, capture_out.append, outputLimit, exceeded, process))]
+    if program is not None:
+        threads.append(threading.Thread(target=WriteProgram, args=program))
+    if stderr_sink is None:
+        threads.append(threading.Thread(target=ReadOutput, args=(process.stderr, capture_err.append, outputLimit, exceeded, process)))
+    else:
+        threads.append(threading.Thread(target=ReadOutput, args=(process.stderr, stderr_sink, None, exceeded, process)))
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        usage = WaitProcess(process)
+    except:
+        KillProcessGroup(process)
+        raise
+    finally:
+        timer.cancel()
+    cpuLimit = dict(stageLimits.get(stage, [])).get(resource.RLIMIT_CPU)
+    # SIGKILL is sent on hard limit when SIGXCPU of soft limit does not end the process
+    exhausted = cpuLimit is not None and (process.returncode == -signal.SIGXCPU or (process.returncode == -signal.SIGKILL and usage.ru_utime + usage.ru_stime >= cpuLimit[0]))
+    RecordStage(stage, None if expired.is_set() or exceeded.is_set() or exhausted else process.returncode, time.time() - start_time, usage.ru_utime + usage.ru_stime, usage=usage, rss_floor=process.rss_floor)
+    if expired.is_set():
+        error = stage + ' timeout (' + str(timeout) + ' s)'
+        Log('ERROR: ' + error)
+        raise TestTimeout(test_id + ' - ' + error)
+    if exhausted:
+        error = stage + ' cpu time limit (' + str(cpuLimit[0]) + ' s) exceeded'
+        Log('ERROR: ' + error)
+        raise TestTimeout(test_id + ' - ' + error)
+    if exceeded.is_set():
+        error = stage + ' output limit (' + str(outputLimit) + ' B) exceeded'
+        Log('ERROR: ' + error)
+        raise TestOutputLimit(test_id + ' - ' + error)
+    # Return info about the execution
+    return {'exit_code' : process.returncode,
+            'stdout' : ''.join(capture_out),
+            'stderr' : ''.join(capture_err)}
+
+# Cached go programs are identified by hash of everything the go compiler gets on input
+def GoBinaryKey(test_code, args):
+    key = hashlib.sha256()
+    key.update(args.go_version + '\0')
+    key.update(args.go_include_code + '\0')
+    key.update(test_code)
+    return key.hexdigest()
+
+# Remove least recently used go programs until cache fits into its size limit
+def EvictGoBinaries(args):
+    directory = os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR)
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        # Programs just being stored by other workers are skipped
+        if '.' in name:
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+        total += stat.st_size
+    entries.sort()
+    for _, size, name in entries:
+        if total <= args.cache_size * 1024 * 1024:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+# Get program from cache into tmp directory, so it can not be evicted by other worker while it runs
+def FetchGoBinary(binary, tmp_binary):
+    try:
+        os.link(binary, tmp_binary)
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return False
+        # Hard links are not supported everywhere (other filesystem, mounts without links)
+        try:
+            shutil.copy(binary, tmp_binary)
+        except (IOError, OSError):
+            return False
+    # Mark program as recently used
+    try:
+        os.utime(binary, None)
+    except OSError:
+        pass
+    return True
+
+# Compile test with go compiler or take already compiled program from cache
+def BuildGo(test_code, args, tmp_dir):
+    binary = os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR, GoBinaryKey(test_code, args))
+    tmp_binary = os.path.join(tmp_dir, TMP_GO_BINARY_NAME)
+    if os.path.isfile(tmp_binary):
+        os.remove(tmp_binary)
+    if FetchGoBinary(binary, tmp_binary):
+        return tmp_binary, None
     tmp_file = os.path.join(tmp_dir, TMP_GO_FILE_NAME)
     template_file = os.path.join(tmp_dir, TMP_TEMPLATE_FILE_NAME)
+    if not os.path.isfile(template_file):
+        shutil.copyfile(args.go_include_file, template_file)
     with open(tmp_file, 'w') as f:
         f.write(test_code)
-    cmd = [interpret, 'run', template_file, tmp_file]
-    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    capture_out, capture_err = process.communicate(input=program_input)
-    return_code = process.returncode
-    process = None
-    # Return info about the execution
-    return {'exit_code' : return_code,
-            'stdout' : capture_out,
-            'stderr' : capture_err}
+    cmd = [args.go_interpreter, 'build', '-o', tmp_binary, template_file, tmp_file]
+    build_info = Execute(cmd, '', args.timeout_go, 'go compiler')
+    if build_info['exit_code'] != 0:
+        # Failed build is reported as the result of the test program
+        return None, build_info
+    # Store program under unique name first, parallel workers may build the same program
+    try:
+        shutil.copy(tmp_binary, binary + '.' + str(os.getpid()))
+        os.rename(binary + '.' + str(os.getpid()), binary)
+    except (IOError, OSError) as error:
+        Log('WARNING: Compiled go program couldn\'t be stored in cache. Reason: ' + str(error))
+        Log('----')
+    EvictGoBinaries(args)
+    return tmp_binary, None
+
+# Run test on native go interpreter
+def RunGo(test_code, program_input, args, tmp_dir):
+    # Execute test compiled by native go compiler
+    binary, build_info = BuildGo(test_code, args, tmp_dir)
+    if binary is None:
+        return build_info
+    return Execute([binary], program_input, args.timeout_go, 'go')
+
+# Stored go outputs are identified by hash of test code, its input and go include file
+# (go version is stored with the output, so it can be used even without go interpreter)
+def GoldenKey(test_code, program_input, args):
+    key = hashlib.sha256()
+    key.update(args.go_include_code + '\0')
+    key.update(test_code + '\0')
+    key.update(program_input)
+    return key.hexdigest()
+
+# Open store of go outputs (every worker process needs its own connection)
+def GoldenStore(args):
+    global golden
+    path = os.path.join(args.cache_dir, CACHE_GOLDEN_FILE)
+    if golden is None or golden[0] != (os.getpid(), path):
+        connection = sqlite3.connect(path, timeout=60)
+        connection.execute('CREATE TABLE IF NOT EXISTS golden (key TEXT PRIMARY KEY, go_version TEXT, exit_code INTEGER, stdout BLOB, stderr BLOB)')
+        connection.commit()
+        golden = ((os.getpid(), path), connection)
+    return golden[1]
+
+# Get output of test on native go interpreter from store or run it and store the output
+def RunGoGolden(test_code, program_input, args, tmp_dir):
+    store = GoldenStore(args)
+    key = GoldenKey(test_code, program_input, args)
+    if not args.refresh_golden:
+        row = store.execute('SELECT go_version, exit_code, stdout, stderr FROM golden WHERE key = ?', (key,)).fetchone()
+        if row is not None and (args.no_go_needed or row[0] == args.go_version):
+            RecordStage('go', row[1], 0.0, 0.0, cached=True)
+            return {'exit_code' : row[1],
+                    'stdout' : bytes(row[2]),
+                    'stderr' : bytes(row[3])}
+    if args.no_go_needed:
+        return None
+    go_info = RunGo(test_code, program_input, args, tmp_dir)
+    StoreGolden(key, go_info, args)
+    return go_info
+
+def StoreGolden(key, go_info, args):
+    store = GoldenStore(args)
+    store.execute('INSERT OR REPLACE INTO golden VALUES (?, ?, ?, ?, ?)', (key, args.go_version, go_info['exit_code'], sqlite3.Binary(go_info['stdout']), sqlite3.Binary(go_info['stderr'])))
+    store.commit()
+
+# Rename top level functions of a test (including main) to use given prefix, so more tests
+# can be built into one go program. Returns None if the test can not be renamed safely
+# (redeclaration of a reserved function would not be detected after renaming).
+def GoBatchSource(test_code, prefix, reserved):
+    tokens = GO_TOKEN.findall(test_code)
+    functions = set()
+    depth = 0
+    previous = None
+    for token in tokens:
+        if token.isspace() or token.startswith('//') or token.startswith('/*'):
+            continue
+        if token[0] >= '\x80':
+            # Non ascii identifiers are not recognized by the tokens
+            return None
+        if depth == 0 and token in ['var', 'const', 'type', 'import']:
+            return None
+        if depth == 0 and previous == 'func':
+            if not re.match(r'[A-Za-z_]', token):
+                # Methods are not part of IFJ20
+                return None
+            functions.add(token)
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+        previous = token
+    if 'main' not in functions or 'init' in functions or functions.intersection(reserved):
+        return None
+    result = []
+    previous = None
+    skip = 0
+    for token in tokens:
+        if token == 'package' and previous is None:
+            # Package clause is part of the driver program
+            skip = 2
+        if skip > 0:
+            if not token.isspace():
+                skip -= 1
+            continue
+        if token in functions and previous != '.':
+            token = prefix + token
+        if not token.isspace() and not token.startswith('//') and not token.startswith('/*'):
+            previous = token
+        result.append(token)
+    return ''.join(result)
+
+# Build go programs of tests into one driver program, which runs the test given by its number.
+# Tests that break the build are left out. Returns the driver path and list of built test numbers.
+def BuildGoBatch(sources, args):
+    directory = os.path.join(args.tmp_dir, TMP_GO_BATCH_DIR)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.mkdir(directory)
+    shutil.copyfile(args.go_include_file, os.path.join(directory, TMP_TEMPLATE_FILE_NAME))
+    for number in sources:
+        with open(os.path.join(directory, GO_BATCH_PREFIX + str(number) + '.go'), 'w') as f:
+            f.write('package main\n' + sources[number])
+    numbers = sorted(sources.keys())
+    while numbers != []:
+        with open(os.path.join(directory, 'main.go'), 'w') as f:
+            f.write('package main\n\nimport "os"\n\nfunc main() {\n\tswitch os.Args[1] {\n')
+            for number in numbers:
+                f.write('\tcase "' + str(number) + '":\n\t\t' + GO_BATCH_PREFIX + str(number) + '_main()\n')
+            f.write('\t}\n}\n')
+        driver = os.path.join(directory, TMP_GO_BATCH_DRIVER_NAME)
+        cmd = [args.go_interpreter, 'build', '-o', driver, os.path.join(directory, TMP_TEMPLATE_FILE_NAME), os.path.join(directory, 'main.go')]
+        cmd += [os.path.join(directory, GO_BATCH_PREFIX + str(number) + '.go') for number in numbers]
+        build_info = Execute(cmd, '', args.timeout_go * len(numbers), 'go compiler')
+        if build_info['exit_code'] == 0:
+            return driver, numbers
+        # Errors contain names of the files, tests with errors are built separately later
+        failed = set(int(number) for number in re.findall(GO_BATCH_PREFIX + r'([0-9]+)\.go:', build_info['stderr']))
+        if not failed.intersection(numbers):
+            return None, []
+        numbers = [number for number in numbers if number not in failed]
+    return None, []
+
+# Run go programs of tests built together in batches and store their outputs, so tests do not need
+# to build their go programs separately
+def RunGoBatch(tests, args):
+    scenarios = {}
+    for test in tests:
+        if test['nogo'] or 0 not in test['compiler'] or 0 not in test['interpret']:
+            continue
+        if not CheckExtensions(test['extensions+'], test['extensions-'], args.extensions):
+            continue
+        test = LoadTest(test)
+        key = GoldenKey(test['code'], test['input'], args)
+        if not args.refresh_golden:
+            row = GoldenStore(args).execute('SELECT go_version FROM golden WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] == args.go_version:
+                continue
+        scenarios.setdefault(test['code_hash'], (test['code'], []))[1].append((key, test['input']))
+    codes = sorted(scenarios.keys())
+    reserved = set(re.findall(r'^func\s+([A-Za-z_][A-Za-z_0-9]*)', args.go_include_code, re.M))
+    built = 0
+    for start in range(0, len(codes), args.go_batch):
+        sources = {}
+        for number, code_hash in zip(itertools.count(), codes[start:start + args.go_batch]):
+            source = GoBatchSource(scenarios[code_hash][0], GO_BATCH_PREFIX + str(number) + '_', reserved)
+            if source is not None:
+                sources[number] = source
+        if sources == {}:
+            continue
+        try:
+            driver, numbers = BuildGoBatch(sources, args)
+        except (TestTimeout, TestOutputLimit):
+            # Tests of the batch are built separately
+            continue
+        for number in numbers:
+            for key, program_input in scenarios[codes[start + number]][1]:
+                try:
+                    StoreGolden(key, Execute([driver, str(number)], program_input, args.timeout_go, 'go'), args)
+                except (TestTimeout, TestOutputLimit):
+                    # Such test gets the same result when it is run separately
+                    pass
+            built += 1
+    print('Go programs built in batches: \'' + str(built) + '\' of \'' + str(len(codes)) + '\'\n')
 
 # Run test on ifj20 compiler
-def RunIfjcomp(test_code, compiler):
-    global process
+def RunIfjcomp(test_code, compiler, timeout):
     # Execute test on ifj20 compiler
-    process = subprocess.Popen(compiler, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    capture_out, capture_err = process.communicate(input=test_code)
-    return_code = process.returncode
-    process = None
-    # Return info about the execution
-    return {'exit_code' : return_code,
-            'stdout' : capture_out,
-            'stderr' : capture_err}
+    return Execute([compiler], test_code, timeout, 'compiler')
+
+# Test code and input are loaded only when the test is run
+def LoadTest(test):
+    test = dict(test)
+    with open(test['path'], 'rb') as f:
+        f.seek(test['code_offset'])
+        test['code'] = f.read()
+    test['input'] = ''
+    if test['input_file'] is not None:
+        with open(test['input_file'], 'rb') as f:
+            test['input'] = f.read()
+    return test
+
+# Run ifj20 compiler only once for all scenarios of the same test
+def RunIfjcompMemo(test, args):
+    key = (args.compiler_fingerprint, test['code_hash'])
+    if key not in compilerMemo:
+        compilerMemo[key] = RunIfjcomp(test['code'], args.compiler, args.timeout_compile)
+        # Compiler results of all scenarios are the same, so they are stored only once
+        if args.save_ifjcode_all and not args.mode_compile_only and compilerMemo[key]['exit_code'] == 0:
+            SaveIfjcode(test['name'].split(':')[0], args.output_folder, compilerMemo[key]['stdout'])
+    else:
+        RecordStage('compiler', compilerMemo[key]['exit_code'], 0.0, 0.0, cached=True)
+    return compilerMemo[key]
+
+# Create anonymous file in memory (None if memfd is not supported)
+def MemoryFile():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+    try:
+        fd = libc.memfd_create('ifjcode', 0)
+    except AttributeError:
+        return None
+    return fd if fd >= 0 else None
+
+# File descriptor of a file with given data that has no name in any directory, so it is never written to disk
+# unless memory is short (anonymous file in memory, or removed file in RAM-backed or tmp directory)
+def ScratchFile(data, tmp_dir):
+    for directory in [None] + SCRATCH_DIRS + [tmp_dir]:
+        try:
+            if directory is None:
+                fd = MemoryFile()
+                if fd is None:
+                    continue
+            elif os.path.isdir(directory):
+                fd, name = tempfile.mkstemp(suffix=TMP_IFJCODE_SUFFIX, dir=directory)
+                os.remove(name)
+            else:
+                continue
+        except OSError:
+            continue
+        try:
+            rest = data
+            while rest:
+                rest = rest[os.write(fd, rest):]
+        except OSError:
+            # Directory is full, next one is tried
+            os.close(fd)
+            continue
+        # File is inherited by the next started process
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+        return fd
+    raise Exception('Scratch file for intermediate code couldn\'t be created in \'' + tmp_dir + '\'')
+
+# Execute interpreter command with intermediate code in a scratch file (path of the file is added to the command)
+def ExecuteProgram(cmd, input_data, program_input, timeout, tmp_dir, stderr_sink=None):
+    fd = ScratchFile(input_data, tmp_dir)
+    try:
+        process = Spawn(cmd + ['/dev/fd/' + str(fd)], stageLimits.get('interpreter'))
+    finally:
+        os.close(fd)
+    return Collect(process, program_input, timeout, 'interpreter', stderr_sink)
 
 # Run interpret with intermediate code
-def RunIclint(input_data, program_input, tmp_dir, interpret):
-    global process
-    # Save intermediate code to file
-    tmp_file = os.path.join(tmp_dir, TMP_IFJCODE_FILE_NAME)
-    with open(tmp_file, 'w') as f:
-        f.write(input_data)
-    # Execute code on interpreter
-    cmd = [interpret, tmp_file]
-    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    capture_out, capture_err = process.communicate(input=program_input)
-    return_code = process.returncode
-    process = None
-    # Return info about the execution
-    return {'exit_code' : return_code,
-            'stdout' : capture_out,
-            'stderr' : capture_err}
+def RunIclint(input_data, program_input, tmp_dir, interpret, timeout):
+    return ExecuteProgram([interpret], input_data, program_input, timeout, tmp_dir)
+
+# Start interpreter that waits for its program on a pipe
+def SpawnInterpreter(interpret):
+    read_fd, write_fd = os.pipe()
+    SetCloexec(write_fd)
+    try:
+        process = Spawn([interpret, '/dev/fd/' + str(read_fd)], stageLimits.get('interpreter'))
+    except:
+        os.close(write_fd)
+        raise
+    finally:
+        os.close(read_fd)
+    return (process, write_fd)
+
+# Run interpret started ahead of time, a new one is started for the next test while this one runs
+def RunIclintPrefork(input_data, program_input, interpret, timeout, pool_size):
+    if interpreterPool == []:
+        interpreterPool.append(SpawnInterpreter(interpret))
+    process, program_fd = interpreterPool.pop(0)
+    while len(interpreterPool) < pool_size:
+        interpreterPool.append(SpawnInterpreter(interpret))
+    return Collect(process, program_input, timeout, 'interpreter', program=(program_fd, input_data))
+
+def CloseInterpreterPool():
+    while interpreterPool != []:
+        process, program_fd = interpreterPool.pop()
+        os.close(program_fd)
+        KillProcessGroup(process)
+        process.wait()
+
+# Run interpret with intermediate code on selected backend (optionally checked against the other one)
+def RunInterpreter(input_data, program_input, args):
+    if args.interpreter_backend == 'prefork':
+        info = RunIclintPrefork(input_data, program_input, args.ifjcode_interpreter, args.timeout_interpret, args.interpreter_pool)
+    else:
+        info = RunIclint(input_data, program_input, args.tmp_dir, args.ifjcode_interpreter, args.timeout_interpret)
+    if args.interpreter_cross_check:
+        if args.interpreter_backend == 'prefork':
+            other = RunIclint(input_data, program_input, args.tmp_dir, args.ifjcode_interpreter, args.timeout_interpret)
+        else:
+            other = RunIclintPrefork(input_data, program_input, args.ifjcode_interpreter, args.timeout_interpret, args.interpreter_pool)
+        if other['exit_code'] != info['exit_code'] or other['stdout'] != info['stdout']:
+            Log('Interpret output (' + args.interpreter_backend + ' backend):\n' + (info['stdout'] or '<empty>'))
+            Log('----')
+            Log('Interpret output (other backend):\n' + (other['stdout'] or '<empty>'))
+            Log('----')
+            error = 'Interpreter backends have different results. Exit codes: ' + str(info['exit_code']) + ' and ' + str(other['exit_code']) + '.'
+            Log('ERROR: ' + error)
+            raise RuntimeError(test_id + ' - ' + error)
+    return info
 
 # Check error code from ifj20 compiler
 def CheckCompilerError(process_info, error_code):
@@ -361,10 +1273,119 @@ def CheckInterpretError(process_info, error_code):
 	# Fail test
         raise RuntimeError(test_id + ' - ' + error)
 
+# Offset of the first difference of two outputs (compared chunk by chunk) or None if they are same
+def FirstDifference(first, second):
+    for offset in range(0, max(len(first), len(second)), OUTPUT_CHUNK_SIZE):
+        if first[offset:offset + OUTPUT_CHUNK_SIZE] != second[offset:offset + OUTPUT_CHUNK_SIZE]:
+            for i in range(offset, offset + OUTPUT_CHUNK_SIZE):
+                if first[i:i + 1] != second[i:i + 1]:
+                    return i
+    return None
+
+# Output split to chunks of whole lines normalised by given rules (rules are applied to a chunk at a time)
+def NormalisedChunks(output, rules):
+    start = 0
+    while start < len(output):
+        end = output.rfind('\n', start, start + OUTPUT_CHUNK_SIZE) + 1
+        if end <= start:
+            end = output.find('\n', start + OUTPUT_CHUNK_SIZE) + 1 or len(output)
+        chunk = output[start:end]
+        for pattern, replacement in rules:
+            chunk = pattern.sub(replacement, chunk)
+        yield chunk
+        start = end
+
+# Number of the first different line of normalised outputs (counted from 0), None if they are same
+def NormalisedDifference(first, second, rules):
+    firstChunks = NormalisedChunks(first, rules)
+    secondChunks = NormalisedChunks(second, rules)
+    firstBuffer = ''
+    secondBuffer = ''
+    lines = 0
+    while True:
+        if firstBuffer == '':
+            firstBuffer = next(firstChunks, '')
+        if secondBuffer == '':
+            secondBuffer = next(secondChunks, '')
+        length = min(len(firstBuffer), len(secondBuffer))
+        if length == 0:
+            return None if firstBuffer == secondBuffer else lines
+        difference = FirstDifference(firstBuffer[:length], secondBuffer[:length])
+        if difference is not None:
+            return lines + firstBuffer.count('\n', 0, difference)
+        lines += firstBuffer.count('\n', 0, length)
+        firstBuffer = firstBuffer[length:]
+        secondBuffer = secondBuffer[length:]
+
+# Offset of the line that is given number of lines after offset (end of output if output is shorter)
+def SkipLines(output, offset, lines):
+    for i in range(lines):
+        offset = output.find('\n', offset) + 1
+        if offset == 0:
+            return len(output)
+    return offset
+
+# Lines of output with their line ends (the last line has none if output does not end with a new line)
+def OutputLines(output):
+    lines = [text + '\n' for text in output.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines[:-1] if lines[-1] == '' else lines
+
+# Log unified diff of normalised outputs limited to lines around their first difference
+def LogOutputDiff(go_output, interpret_output, start, line, names):
+    rules = [OUTPUT_RULES[name] for name in names]
+    # Go back to show the context before the first different line
+    for i in range(DIFF_CONTEXT):
+        if start == 0:
+            break
+        start = go_output.rfind('\n', 0, start - 1) + 1
+        line += 1
+    context = min(line, DIFF_CONTEXT)
+    # Windows are twice as long as shown part, so lines inserted into one output are matched with lines after them
+    windows = []
+    for output in [go_output, interpret_output]:
+        begin = SkipLines(output, start, line - context)
+        end = SkipLines(output, begin, context + 2 * DIFF_LINES)
+        windows.append((output.count('\n', 0, begin) + 1, OutputLines(''.join(NormalisedChunks(output[begin:end], rules)))))
+    (goLine, goLines), (interpretLine, interpretLines) = windows
+    def Shorten(text):
+        return text if len(text) <= DIFF_LINE_LENGTH else text[:DIFF_LINE_LENGTH] + '...'
+    # Only the context and given number of lines from the first difference are shown
+    shown = []
+    counts = [0, 0]
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, goLines, interpretLines, False).get_opcodes():
+        if tag == 'equal':
+            changes = [(' ', text) for text in goLines[i1:i2]]
+        else:
+            changes = [('-', text) for text in goLines[i1:i2]] + [('+', text) for text in interpretLines[j1:j2]]
+        for prefix, text in changes:
+            if len(shown) >= context + DIFF_LINES:
+                break
+            shown.append((prefix, text))
+            counts[0] += prefix != '+'
+            counts[1] += prefix != '-'
+    # Empty range starts at the line before it (as in unified diff)
+    diff = ['--- go output', '+++ interpret output', '@@ -%d,%d +%d,%d @@' % (goLine - (counts[0] == 0), counts[0], interpretLine - (counts[1] == 0), counts[1])]
+    for prefix, text in shown:
+        if text.endswith('\n'):
+            diff.append(prefix + Shorten(text[:-1]))
+        else:
+            diff += [prefix + Shorten(text), '\\ No newline at end of file']
+    Log('Output difference (normalised by rules: ' + ', '.join(names) + '):\n' + '\n'.join(diff))
+
 # Check output from native go interpreter and ifj20 interpreter
-def CheckSameOutput(interpret_info, go_info, log_success):
-    def TransformOutput(output):
-        return re.sub(r'(0x[0-9a-fA-F\.]+p\+)0([0-9])', r'\1\2', output)
+def CheckSameOutput(interpret_info, go_info, log_success, normalize):
+    names = sorted(set(DEFAULT_OUTPUT_RULES + normalize))
+    rules = [OUTPUT_RULES[name] for name in names]
+
+    # Outputs are same up to the first difference, so they are normalised only from the line containing it
+    def OutputDifference(interpret_output, go_output):
+        difference = FirstDifference(interpret_output, go_output)
+        if difference is None:
+            return None
+        start = go_output.rfind('\n', 0, difference) + 1
+        line = NormalisedDifference(go_output[start:], interpret_output[start:], rules)
+        return None if line is None else (start, line)
 
     # Check if go and ifj20 have the save exit code
     if interpret_info['exit_code'] != go_info['exit_code']:
@@ -379,20 +1400,19 @@ def CheckSameOutput(interpret_info, go_info, log_success):
         raise RuntimeError(test_id + ' - ' + error)
 
     # Check standart output of go and ifj20
-    if (interpret_info['stdout'] != go_info['stdout']) and (interpret_info['stdout'] != TransformOutput(go_info['stdout'])):
+    difference = OutputDifference(interpret_info['stdout'], go_info['stdout'])
+    if difference is not None:
 	# Log error
         Log('Go error output:\n' + (go_info['stderr'] or '<empty>'))
         Log('----')
         Log('Interpret error output:\n' + (interpret_info['stderr'] or '<empty>'))
         Log('----')
-        Log('Go output:\n' + (go_info['stdout'] or '<empty>'))
-        Log('----')
-        Log('Interpret output:\n' + (interpret_info['stdout'] or '<empty>'))
+        LogOutputDiff(go_info['stdout'], interpret_info['stdout'], difference[0], difference[1], names)
         Log('----')
         error = 'Go and IFJ interprets have different outputs.'
         Log('ERROR: ' + error)
 	# Fail test
-        raise RuntimeError(test_iid + ' - ' + error)
+        raise RuntimeError(test_id + ' - ' + error)
     
     # Log successfull test output
     if log_success:
@@ -408,22 +1428,50 @@ def CheckExtensions(required, forbiden, extensions):
             return False
     return True
 
-# Save intermetiate code
+# Save intermetiate code (it is written by a background thread of the process, so tests do not wait for the disk)
 def SaveIfjcode(name, directory, data):
+        global ifjcodeWriter
         parts = name.split(':')
         fileName = os.path.basename(parts[0])
         if len(parts) > 1:
             fileName += ':' + os.path.basename(parts[1])
         outputFileName = fileName + '.ifjcode'
-        f = open(os.path.join(directory, outputFileName), 'w')
-        f.write(data)
-        f.close()
+        # Writer of the parent process is not running in worker processes
+        if ifjcodeWriter is None or ifjcodeWriter[0] != os.getpid():
+            ifjcodeWriter = (os.getpid(), Queue.Queue(), [])
+            thread = threading.Thread(target=WriteSavedIfjcode, args=ifjcodeWriter[1:])
+            thread.daemon = True
+            thread.start()
+        ifjcodeWriter[1].put((os.path.join(directory, outputFileName), data))
+
+# Write saved intermediate code in batches of all files waiting at the moment
+def WriteSavedIfjcode(queue, errors):
+    while True:
+        batch = [queue.get()]
+        while True:
+            try:
+                batch.append(queue.get_nowait())
+            except Queue.Empty:
+                break
+        for path, data in batch:
+            try:
+                with open(path, 'w') as f:
+                    f.write(data)
+            except IOError as error:
+                errors.append(str(error))
+            queue.task_done()
+
+# Wait until all intermediate code saved by this process is written
+def FlushSavedIfjcode():
+    if ifjcodeWriter is None or ifjcodeWriter[0] != os.getpid():
+        return
+    ifjcodeWriter[1].join()
+    while ifjcodeWriter[2] != []:
+        print('WARNING: Intermediate code couldn\'t be saved. Reason: ' + ifjcodeWriter[2].pop(0))
 
 def RunTest(test, args):
     # Global variables must be accessed here
-    global test_index
     global test_id
-    test_index = test_index + 1
     test_id = test['name']
     # Log current test
     Log('\n********************\nTEST ' + str(test_index) + ': ' + test_id + '\n********************\n')
@@ -441,7 +1489,7 @@ def RunTest(test, args):
         Log('SKIPED')
         return False
     # Run ifj20 compiler
-    compiler_info = RunIfjcomp(test['code'], args.compiler)
+    compiler_info = RunIfjcompMemo(test, args)
     # Check compiler for error
     CheckCompilerError(compiler_info, test['compiler'])
     # End execution if tests are compile only
@@ -457,7 +1505,7 @@ def RunTest(test, args):
     # If this part fails, the intermedate code must be saved for further analysis
     try:
 	# Run ifj20 interpret
-        interpret_info = RunIclint(compiler_info['stdout'], test['input'], args.tmp_dir, args.ifjcode_interpreter)
+        interpret_info = RunInterpreter(compiler_info['stdout'], test['input'], args)
 	# Check interpret for error
         CheckInterpretError(interpret_info, test['interpret'])
 	# End execution if tests are compile and interpret only
@@ -471,61 +1519,1202 @@ def RunTest(test, args):
             return True
 
 	# Run test on native go interpreter and compare results with ifj20 interpreter
-        go_info = RunGo(test['code'], test['input'], args.go_interpreter, args.tmp_dir)
-        CheckSameOutput(interpret_info, go_info, args.log_success_output)
+        go_info = RunGoGolden(test['code'], test['input'], args, args.tmp_dir)
+        if go_info is None:
+            # Log warning about incomplete testing
+            Log('WARNING: This test was not entirely completed, because there is no stored go output for it.')
+            Log('         Output checks were not run (run tests with go interpreter first).')
+            Log('----')
+        else:
+            CheckSameOutput(interpret_info, go_info, args.log_success_output, test['normalize'])
     except:
         SaveIfjcode(test['name'], args.output_folder, compiler_info['stdout'])
         raise
-    else:
-        if args.save_ifjcode_all:
-            SaveIfjcode(test['name'], args.output_folder, compiler_info['stdout'])
 
     # Test successfull
     Log('SUCCESS')
     return True
 
-def AlarmHandle(signum, frame):
-    Log('ERROR: test timeout')
-    raise RuntimeError("test timeout")
 
 
 
-# Main program
+# Hash of file content (or of the command itself, if it is not a file)
+def FileFingerprint(path):
+    key = hashlib.sha256()
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                key.update(chunk)
+    else:
+        key.update(path)
+    return key.hexdigest()
 
-args = ParseArgs()
-tests = ProcessTests(args)
-print('\n-------- RESULTS --------\n')
-if args.log_none:
-    logEnable = False
-elif not args.log_output:
-    log = open(args.log_file, 'w')
-signal.signal(signal.SIGALRM, AlarmHandle)
-passed = 0
-failed = 0
-skiped = 0
-for test in tests:
+# Fingerprint of everything outside of tests that affects their results
+def RunFingerprint(args):
+    key = hashlib.sha256()
+    key.update(json.dumps([args.compiler_fingerprint,
+                           FileFingerprint(args.ifjcode_interpreter),
+                           args.go_include_code,
+                           args.go_version,
+                           args.no_go_needed,
+                           args.mode_compile_only,
+                           args.mode_interpret_only,
+                           sorted(args.extensions)]))
+    return key.hexdigest()
+
+def TestFingerprint(test, runFingerprint):
+    key = hashlib.sha256()
+    key.update(runFingerprint)
+    key.update(json.dumps(test, sort_keys=True))
+    if test['input_file'] is not None:
+        key.update(FileFingerprint(test['input_file']))
+    return key.hexdigest()
+
+# Last verdicts of tests (name -> [fingerprint, verdict])
+def LoadIncrementalState(args):
+    path = os.path.join(args.cache_dir, CACHE_INCREMENTAL_FILE)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print('ignoring corrupted incremental state file \'' + path + '\'')
+        return {}
+
+def SaveIncrementalState(args, state):
+    path = os.path.join(args.cache_dir, CACHE_INCREMENTAL_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.rename(path + '.tmp', path)
+
+# Durations and last verdicts of tests (name -> {'duration', 'verdicts'})
+def LoadHistory(args):
+    path = os.path.join(args.cache_dir, CACHE_HISTORY_FILE)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print('ignoring corrupted history file \'' + path + '\'')
+        return {}
+
+def SaveHistory(args, history):
+    path = os.path.join(args.cache_dir, CACHE_HISTORY_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(history, f)
+    os.rename(path + '.tmp', path)
+
+def UpdateHistory(history, record):
+    entry = history.setdefault(record['name'], {'duration' : 0.0, 'verdicts' : []})
+    entry['duration'] = sum(stage['wall_time'] for stage in record['stages'].values())
+    entry['verdicts'] = (entry['verdicts'] + [record['verdict']])[-HISTORY_VERDICTS:]
+
+# Order of test groups: recently failed, then flaky (passing and failing in history), then the rest.
+# Long groups go first when run in parallel (they do not finish last), short ones otherwise (failures show sooner).
+def PrioritizeGroups(groups, history, args):
+    def Priority(group):
+        priority = 2
+        duration = 0.0
+        for _, test in group:
+            entry = history.get(test['name'], {'duration' : 0.0, 'verdicts' : []})
+            duration += entry['duration']
+            if entry['verdicts'] != [] and entry['verdicts'][-1] in FAILURE_VERDICTS:
+                priority = min(priority, 0)
+            elif any(verdict in FAILURE_VERDICTS for verdict in entry['verdicts']):
+                priority = min(priority, 1)
+        return (priority, -duration if args.jobs > 1 else duration)
+    return sorted(groups, key=Priority)
+
+# Names of tests in the shard selected by --shard. Tests of the same file are kept together (their code is compiled only once).
+# Partition depends only on test paths and shard history (not on order of tests), so every machine computes the same one.
+def ShardTests(tests, args):
+    history = {}
+    if args.shard_history is not None:
+        with open(args.shard_history, 'r') as f:
+            history = json.load(f)
+    files = {}
+    for test in tests:
+        files.setdefault(os.path.normpath(test['path']), []).append(test['name'])
+    durations = {}
+    for path, names in files.items():
+        known = [history[name]['duration'] for name in names if name in history]
+        if known != []:
+            durations[path] = sum(known)
+    shard = {}
+    if durations == {}:
+        for path in files:
+            shard[path] = int(hashlib.sha256(path).hexdigest(), 16) % args.shards
+    else:
+        # Files without history are expected to take as long as the median file with history.
+        # Longest files are placed first, each to the shard with the least work so far.
+        default = sorted(durations.values())[len(durations) // 2]
+        loads = [0.0] * args.shards
+        for path in sorted(files.keys(), key=lambda path: (-durations.get(path, default), path)):
+            shard[path] = loads.index(min(loads))
+            loads[shard[path]] += durations.get(path, default)
+    return set(name for path, names in files.items() if shard[path] == args.shard - 1 for name in names)
+
+# Run loaded test and return its verdict together with error message of its failure
+def TestVerdict(test, args):
     try:
-        signal.alarm(args.timeout)
         result = RunTest(test, args)
-        signal.alarm(0)
-    except Exception as error:
-        if process is not None:
-            process.terminate()
-        failed = failed + 1
-        print(test['name'] + ': FAILED')
+    except TestTimeout as ex:
+        return ('TIMEOUT', str(ex))
+    except TestOutputLimit as ex:
+        return ('OUTPUT_LIMIT', str(ex))
+    except Exception as ex:
+        return ('FAILED', str(ex))
+    return ('PASSED' if result else 'SKIPED', None)
+
+# Run single test and return its verdict together with its log messages and report record
+def ExecuteTest(index, test, args):
+    global test_index
+    global logBuffer
+    global testStages
+    test_index = index
+    logBuffer = []
+    testStages = {}
+    verdict, error = TestVerdict(LoadTest(test), args)
+    for stage in sorted(testStages.keys()):
+        if not testStages[stage]['cached']:
+            Log('resources of ' + stage + ': ' + FormatUsage(testStages[stage]))
+    return (verdict, logBuffer, ReportRecord(index, test, verdict, error, testStages))
+
+# Peak memory of processes of a stage (only its upper bound is known if it is not above size of the testsuite)
+def FormatRss(info):
+    if info.get('max_rss', 0) > info.get('rss_floor', 0):
+        return '%.1f MB' % (info['max_rss'] / 1024.0)
+    return '<= %.1f MB' % (info.get('rss_floor', 0) / 1024.0)
+
+# Times and memory used by processes of a stage
+def FormatUsage(info):
+    return ('cpu %.1f ms (user %.1f ms, sys %.1f ms), wall %.1f ms, max RSS %s' %
+            (info['cpu_time'] * 1000, info.get('user_time', 0.0) * 1000, info.get('sys_time', 0.0) * 1000, info['wall_time'] * 1000, FormatRss(info)))
+
+# Print tests with the most cpu time and the most memory used by compiler and interpreter
+def PrintTopTests(records, count):
+    def Stages(record):
+        return [(stage, record['stages'][stage]) for stage in MEASURED_STAGES if stage in record['stages'] and not record['stages'][stage]['cached']]
+    # Memory of a test is known only if some of its processes used more than the testsuite
+    def Memory(record):
+        return max([info.get('max_rss', 0) for _, info in Stages(record) if info.get('max_rss', 0) > info.get('rss_floor', 0)] or [0])
+    records = [record for record in records if Stages(record) != []]
+    if count <= 0 or records == []:
+        return
+    print('\nMOST CPU TIME (compiler and interpreter):')
+    for record in sorted(records, key=lambda record: -sum(info['cpu_time'] for _, info in Stages(record)))[:count]:
+        stages = Stages(record)
+        print('%s: %.1f ms (%s)' % (record['name'], sum(info['cpu_time'] for _, info in stages) * 1000, ', '.join('%s %.1f ms' % (stage, info['cpu_time'] * 1000) for stage, info in stages)))
+    print('(executed instructions are counted only in benchmark mode, see --benchmark)')
+    print('\nMOST MEMORY (max RSS of compiler and interpreter):')
+    hungry = [record for record in records if Memory(record) > 0]
+    for record in sorted(hungry, key=lambda record: -Memory(record))[:count]:
+        print('%s: %.1f MB (%s)' % (record['name'], Memory(record) / 1024.0, ', '.join(stage + ' ' + FormatRss(info) for stage, info in Stages(record))))
+    if hungry == []:
+        print('no test used more memory than the testsuite process (%.1f MB)' % (max(info.get('rss_floor', 0) for record in records for _, info in Stages(record)) / 1024.0))
+
+# Run scenarios of the same test (compiler results are shared only within the group)
+def ExecuteGroup(group, args):
+    results = [ExecuteTest(index, test, args) for index, test in group]
+    compilerMemo.clear()
+    return results
+
+def ReportRecord(index, test, verdict, error, stages):
+    return {'index' : index,
+            'name' : test['name'],
+            'verdict' : verdict,
+            'error' : error,
+            'expected' : {'compiler' : test['compiler'], 'interpreter' : test['interpret']},
+            'stages' : stages}
+
+def OpenReport(args):
+    if args.report is None:
+        return None
+    report = open(args.report_file, 'w')
+    if args.report == 'junit':
+        report.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n<testsuite name="IFJ20">\n')
+    return report
+
+# Report is written as tests finish, so it can be followed while tests are running
+def WriteReport(report, args, record):
+    if report is None:
+        return
+    if args.report == 'jsonl':
+        report.write(json.dumps(record, sort_keys=True) + '\n')
     else:
-        if result:
+        parts = record['name'].split(':')
+        name = os.path.basename(parts[0]) + (':' + parts[1] if len(parts) > 1 else '')
+        classname = os.path.dirname(os.path.normpath(parts[0])).replace(os.sep, '.')
+        total = sum(stage['wall_time'] for stage in record['stages'].values())
+        report.write('<testcase classname=' + quoteattr(classname) + ' name=' + quoteattr(name) + ' time="' + ('%.3f' % total) + '">\n')
+        report.write('<properties>\n')
+        for stage in sorted(record['stages'].keys()):
+            for key in ['exit_code', 'wall_time', 'cpu_time', 'user_time', 'sys_time', 'max_rss', 'rss_floor', 'cached']:
+                if key in record['stages'][stage]:
+                    report.write('<property name=' + quoteattr(stage + '.' + key) + ' value=' + quoteattr(str(record['stages'][stage][key])) + '/>\n')
+        report.write('</properties>\n')
+        if record['verdict'] == 'FAILED':
+            report.write('<failure message=' + quoteattr(record['error'] or '') + '/>\n')
+        elif record['verdict'] == 'TIMEOUT':
+            report.write('<error type="timeout" message=' + quoteattr(record['error'] or '') + '/>\n')
+        elif record['verdict'] == 'OUTPUT_LIMIT':
+            report.write('<error type="output limit" message=' + quoteattr(record['error'] or '') + '/>\n')
+        elif record['verdict'] == 'SKIPED':
+            report.write('<skipped/>\n')
+        report.write('</testcase>\n')
+    report.flush()
+
+def CloseReport(report, args):
+    if report is None:
+        return
+    if args.report == 'junit':
+        report.write('</testsuite>\n</testsuites>\n')
+    report.close()
+
+# Every worker process gets its own tmp directory, so tmp files of parallel tests do not collide
+def InitWorker(args):
+    global workerArgs
+    # Interpreters started ahead of time belong to the process that started them
+    del interpreterPool[:]
+    workerArgs = argparse.Namespace(**vars(args))
+    workerArgs.tmp_dir = tempfile.mkdtemp(prefix=TMP_WORKER_DIR_PREFIX, dir=args.tmp_dir)
+
+# Saved intermediate code is written before results are returned, worker may be terminated after them
+def ExecuteGroupInWorker(group):
+    results = ExecuteGroup(group, workerArgs)
+    FlushSavedIfjcode()
+    return results
+
+# Shard file starts with a line describing the shard, followed by report records of its tests (with their log messages)
+def OpenShardFile(args, selected, total):
+    if args.shard is None:
+        return None
+    shardFile = open(args.shard_file, 'w')
+    shardFile.write(json.dumps({'shard' : args.shard, 'shards' : args.shards, 'tests' : selected, 'total' : total}, sort_keys=True) + '\n')
+    return shardFile
+
+def WriteShardFile(shardFile, record, messages):
+    if shardFile is None:
+        return
+    record = dict(record)
+    record['log'] = messages
+    shardFile.write(json.dumps(record, sort_keys=True) + '\n')
+    shardFile.flush()
+
+def ParseMergeArgs():
+    parser = argparse.ArgumentParser(prog='testsuite.py merge', description='combine results of IFJ20 tests run in shards (--shard) into one summary and log')
+    parser.add_argument('shard_files', nargs='+', metavar='FILE', help='shard file written by a run with --shard')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--log-file', '-lf', default=DEFAULT_LOG_FILE, help='path to the combined log file (if file already exists, it will be overwritten). default: ' + DEFAULT_LOG_FILE)
+    group.add_argument('--log-output', '-lo', action='store_true', help='print logs to the standard output instead of a file')
+    group.add_argument('--log-none', '-ln', action='store_true', help='do not print logs to output or a file')
+    parser.add_argument('--history-file', help='path to the history file updated with results of all shards (to be used by --shard-history of next runs)')
+    parser.add_argument('--top', default=DEFAULT_TOP, type=int, help='number of tests with the most cpu time and memory used by compiler and interpreter listed in summary. default: ' + str(DEFAULT_TOP))
+    args = parser.parse_args(sys.argv[2:])
+    for path in args.shard_files:
+        if not os.path.isfile(path):
+            raise Exception('Shard file \'' + path + '\' does not exists')
+    if os.path.isdir(args.log_file):
+        raise Exception('There is a directory with the same name as specified log file \'' + args.log_file + '\'')
+    if args.history_file is not None and os.path.isdir(args.history_file):
+        raise Exception('There is a directory with the same name as specified history file \'' + args.history_file + '\'')
+    return args
+
+# Merge mode prints results of all shards in order of tests as if they were run at once
+def MergeShards(args):
+    shards = {}
+    records = {}
+    for path in args.shard_files:
+        with open(path, 'r') as f:
+            header = json.loads(f.readline())
+            if 'shard' not in header:
+                raise Exception('File \'' + path + '\' is not a shard file')
+            if header['shard'] in shards:
+                raise Exception('Shard \'' + str(header['shard']) + '/' + str(header['shards']) + '\' is given more than once')
+            shards[header['shard']] = header
+            for line in f:
+                record = json.loads(line)
+                if record['name'] in records:
+                    print('WARNING: test \'' + record['name'] + '\' was run in more shards, shards were not run with the same tests or history')
+                records[record['name']] = record
+    counts = set(header['shards'] for header in shards.values())
+    if len(counts) > 1:
+        raise Exception('Shard files come from runs with different number of shards')
+    count = counts.pop()
+    missing = [str(shard) + '/' + str(count) for shard in range(1, count + 1) if shard not in shards]
+    if missing != []:
+        print('WARNING: missing shards ' + ', '.join(missing))
+    OpenLog(args)
+    print('\n-------- RESULTS --------\n')
+    verdicts = {}
+    for record in sorted(records.values(), key=lambda record: (record['index'], record['name'])):
+        if logEnable:
+            FlushLog(record['log'])
+        print(record['name'] + ': ' + record['verdict'] + (' (unchanged)' if record.get('unchanged') else ''))
+        verdicts[record['verdict']] = verdicts.get(record['verdict'], 0) + 1
+    CloseLog()
+    if args.history_file is not None:
+        history = {}
+        if os.path.isfile(args.history_file):
+            with open(args.history_file, 'r') as f:
+                history = json.load(f)
+        for record in records.values():
+            if not record.get('unchanged'):
+                UpdateHistory(history, record)
+        with open(args.history_file + '.tmp', 'w') as f:
+            json.dump(history, f)
+        os.rename(args.history_file + '.tmp', args.history_file)
+    notRun = sum(header['tests'] for header in shards.values()) - len(records)
+    print('\n-------- SUMMARY --------\n')
+    for verdict in ['PASSED', 'FAILED', 'TIMEOUT', 'OUTPUT_LIMIT', 'SKIPED']:
+        print(verdict + ': ' + str(verdicts.get(verdict, 0)))
+    if notRun > 0:
+        print('NOT RUN: ' + str(notRun) + ' (shards stopped after failures)')
+    total = set(header['total'] for header in shards.values())
+    if missing == [] and len(total) == 1 and sum(header['tests'] for header in shards.values()) != total.pop():
+        print('WARNING: shards do not cover all selected tests, shards were not run with the same tests or history')
+    PrintTopTests([record for record in records.values() if not record.get('unchanged')], args.top)
+
+
+
+# Run test with given code instead of code from its file and return its verdict with error message
+def ReduceCandidate(test, code, args):
+    global logBuffer
+    global testStages
+    logBuffer = []
+    testStages = {}
+    test = dict(test)
+    test['code'] = code
+    test['code_hash'] = hashlib.sha256(code).hexdigest()
+    result = TestVerdict(test, args)
+    compilerMemo.clear()
+    return result
+
+def ReduceCandidateInWorker(candidate):
+    result = ReduceCandidate(candidate[0], candidate[1], workerArgs)
+    FlushSavedIfjcode()
+    return result
+
+# Lines of test code (with line ends) that are removed together at given reduction level (list of lists of line numbers)
+def ReduceUnits(lines, level):
+    # Braces in each line (braces in comments and literals are ignored)
+    braces = [[] for line in lines]
+    number = 0
+    for token in GO_TOKEN.findall(''.join(lines)):
+        if token in ['{', '}']:
+            braces[number].append(token)
+        number += token.count('\n')
+    depths = []
+    depth = 0
+    for line in braces:
+        depths.append(depth)
+        depth += line.count('{') - line.count('}')
+    units = []
+    for number, line in enumerate(lines):
+        text = line.strip()
+        if level == 'line':
+            if braces[number] == [] and not text.startswith('package '):
+                units.append([number])
+            continue
+        if '{' not in braces[number] or text.startswith('}'):
+            continue
+        if level == 'function' and (depths[number] != 0 or not text.startswith('func ') or re.match(r'func\s+main\s*\(', text)):
+            continue
+        if level == 'block' and depths[number] == 0:
+            continue
+        # Block ends on the line where depth returns to depth of its first line (else branches are included)
+        end = number
+        while end + 1 < len(lines) and depths[end + 1] > depths[number]:
+            end += 1
+        units.append(range(number, end + 1))
+    return units
+
+# Delta debugging of test code on one level, parts of units are removed while the test still fails the same way
+def ReduceLevel(lines, level, reproduces):
+    units = ReduceUnits(lines, level)
+    parts = 2
+    while units != []:
+        parts = min(parts, len(units))
+        size = int(math.ceil(len(units) / float(parts)))
+        candidates = []
+        for start in range(0, len(units), size):
+            removed = set(number for unit in units[start:start + size] for number in unit)
+            candidates.append([line for number, line in enumerate(lines) if number not in removed])
+        found = reproduces(candidates)
+        if found is not None:
+            lines = candidates[found]
+            units = ReduceUnits(lines, level)
+            parts = max(parts - 1, 2)
+        elif parts == len(units):
+            break
+        else:
+            parts = parts * 2
+    return lines
+
+# Reduce mode, code of the test is reduced and written together with its header to reduce file
+def ReduceTest(tests, args):
+    selected = [test for test in tests if args.test in [test['name'], test['path']]]
+    if selected == []:
+        raise Exception('There is no test \'' + args.test + '\'')
+    # Test file with more scenarios is reduced using the first scenario that fails
+    for test in selected:
+        test = LoadTest(test)
+        verdict, error = ReduceCandidate(test, test['code'], args)
+        print(test['name'] + ': ' + verdict)
+        if verdict == args.verdict or (args.verdict is None and verdict in FAILURE_VERDICTS):
+            break
+    else:
+        raise Exception('Test \'' + args.test + '\' does not fail' + (' with verdict ' + args.verdict if args.verdict is not None else ''))
+    print('reducing test \'' + test['name'] + '\' while it fails with ' + verdict + ('' if args.any_error else ': ' + error))
+    # Go programs and outputs of candidates are never used again, so they are not kept in cache directory
+    args.cache_dir = tempfile.mkdtemp(prefix=TMP_REDUCE_CACHE_PREFIX, dir=args.tmp_dir)
+    os.mkdir(os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR))
+
+    # Verdicts of candidates are stored by hash of their code, so the same candidate is never run twice
+    verdicts = {}
+    pool = multiprocessing.Pool(args.jobs, InitWorker, (args,)) if args.jobs > 1 else None
+    def Reproduces(candidates):
+        # Candidates are run in batches of parallel jobs, the first candidate that fails the same way is used
+        for start in range(0, len(candidates), args.jobs):
+            codes = [''.join(lines) for lines in candidates[start:start + args.jobs]]
+            missing = list(set(code for code in codes if hashlib.sha256(code).hexdigest() not in verdicts))
+            if pool is not None:
+                results = pool.map(ReduceCandidateInWorker, [(test, code) for code in missing])
+            else:
+                results = [ReduceCandidate(test, code, args) for code in missing]
+            for code, result in zip(missing, results):
+                verdicts[hashlib.sha256(code).hexdigest()] = result
+            for i, code in enumerate(codes):
+                result = verdicts[hashlib.sha256(code).hexdigest()]
+                if result[0] == verdict and (args.any_error or result[1] == error):
+                    return start + i
+        return None
+
+    lines = test['code'].splitlines(True)
+    print('code has ' + str(len(lines)) + ' lines')
+    try:
+        while True:
+            previous = lines
+            for level in REDUCE_LEVELS:
+                lines = ReduceLevel(lines, level, Reproduces)
+                print('after reduction of ' + level + 's code has ' + str(len(lines)) + ' lines (candidates run: ' + str(len(verdicts)) + ')')
+            if lines == previous:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    CloseInterpreterPool()
+    FlushSavedIfjcode()
+
+    # Header is kept, only input pragma is changed to the reduced scenario (relative to the reduce file)
+    with open(test['path'], 'rb') as f:
+        header = f.read(test['code_offset']).splitlines(True)
+    header = [line for line in header if not line.strip().startswith('//input ')]
+    if test['input_file'] is not None:
+        inputFile = os.path.relpath(test['input_file'], os.path.dirname(os.path.abspath(args.reduce_file)))
+        header.insert(len(header) - 1, '//input ' + inputFile + '\n')
+    with open(args.reduce_file, 'w') as f:
+        f.write(''.join(header + lines))
+    print('reduced test written to \'' + args.reduce_file + '\'')
+
+    # Log of the reduced test shows how it fails
+    OpenLog(args)
+    ReduceCandidate(test, ''.join(lines), args)
+    FlushLog(logBuffer)
+    CloseLog()
+    FlushSavedIfjcode()
+
+# Random well typed IFJ20 program generated from seed. Values are kept small (bounds of their absolute values and lengths
+# of strings are tracked), so programs never overflow, divisors are nonzero literals and loops have constant number of iterations.
+# Float operations always have a non constant operand, because go evaluates constant expressions exactly (not in float64).
+def GenerateProgram(seed, extensions, builtins):
+    rng = random.Random(seed)
+    types = ['int', 'float64', 'string'] + (['bool'] if 'BOOLTHEN' in extensions else [])
+    scopes = []
+    functions = []
+    lines = []
+    state = {'names' : 0, 'loops' : 0}
+
+    def Name(prefix):
+        state['names'] += 1
+        return prefix + str(state['names'])
+
+    # Visible variables of given type as (name, info) pairs, info contains type, bound, loop level and counter flag
+    def Variables(type, assignable=False):
+        result = []
+        for scope in scopes:
+            for name in sorted(scope.keys()):
+                info = scope[name]
+                if info['type'] == type and (not assignable or (not info['counter'] and info['loop'] == state['loops'])):
+                    result.append((name, info))
+        return result
+
+    def Declare(name, type, bound, counter=False):
+        scopes[-1][name] = {'type' : type, 'bound' : bound, 'loop' : state['loops'], 'counter' : counter}
+
+    # Expressions are tuples (text, bound, precedence, constant)
+    def Literal(type, nonzero=False):
+        if type == 'int':
+            value = rng.randint(1 if nonzero else 0, 9 if nonzero else 100)
+            text = str(value)
+            if 'BASE' in extensions and not nonzero:
+                text = rng.choice([text, '0x%X' % value, '0o%o' % value, '0b' + bin(value)[2:]])
+            return (text, value, 3, True)
+        if type == 'float64':
+            if nonzero:
+                text = rng.choice(['0.5', '2.0', '4.0', '1.25', '3.0', '1e1'])
+            else:
+                text = rng.choice(['%d.%d' % (rng.randint(0, 99), rng.randint(0, 99)), '%de%d' % (rng.randint(1, 9), rng.randint(-2, 2)), '%d.%de%+d' % (rng.randint(0, 9), rng.randint(0, 99), rng.randint(-2, 2))])
+            return (text, abs(float(text)), 3, True)
+        if type == 'string':
+            pieces = []
+            for i in range(rng.randint(0, 8)):
+                if rng.random() < 0.2:
+                    pieces.append(rng.choice(['\\n', '\\t', '\\\\', '\\"', '\\x%02x' % rng.randint(0x20, 0x7e)]))
+                else:
+                    pieces.append(rng.choice('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 _.,:;!?()[]{}<>=+-*/#$%&@^~|'))
+            return ('"' + ''.join(pieces) + '"', len(pieces), 3, True)
+        return (rng.choice(['true', 'false']), 1, 3, True)
+
+    def Term(type, bound=None):
+        variables = [(name, info) for name, info in Variables(type) if bound is None or info['bound'] <= bound]
+        if variables != [] and rng.random() < 0.7:
+            name, info = rng.choice(variables)
+            return (name, info['bound'], 3, False)
+        result = Literal(type)
+        if bound is not None and result[1] > bound:
+            return Literal(type, True)
+        return result
+
+    # Operand is put in parentheses only when precedence requires it (operators are left associative)
+    def Operand(expression, precedence, right):
+        if expression[2] < precedence or (right and expression[2] == precedence):
+            return '(' + expression[0] + ')'
+        return expression[0]
+
+    def Expression(type, depth):
+        if type == 'bool':
+            return Condition(depth)
+        if depth <= 0 or rng.random() < 0.3:
+            result = Term(type)
+            if 'UNARY' in extensions and type != 'string' and rng.random() < 0.15:
+                return ('-' + result[0], result[1], 3, result[3])
+            return result
+        if 'FUNEXP' in extensions and rng.random() < 0.2:
+            result = CallExpression(type, depth)
+            if result is not None:
+                return result
+        op = rng.choice(['+'] if type == 'string' else ['+', '-', '*', '/'])
+        left = Expression(type, depth - 1)
+        right = Literal(type, True) if op == '/' else Expression(type, depth - 1)
+        if type == 'float64' and left[3] and right[3]:
+            variables = Variables('float64')
+            if variables == []:
+                return left
+            name, info = rng.choice(variables)
+            left = (name, info['bound'], 3, False)
+        if op in ['+', '-']:
+            bound = left[1] + right[1]
+        elif op == '*':
+            bound = left[1] * right[1]
+        elif type == 'int':
+            bound = left[1]
+        else:
+            bound = left[1] / abs(float(right[0]))
+        if bound > FUZZ_BOUNDS[type]:
+            return Term(type, FUZZ_BOUNDS[type])
+        precedence = 1 if op in ['+', '-'] else 2
+        return (Operand(left, precedence, False) + ' ' + op + ' ' + Operand(right, precedence, True), bound, precedence, left[3] and right[3])
+
+    # Calls inside of expressions (FUNEXP extension), only functions with single result
+    def CallExpression(type, depth):
+        candidates = [function for function in functions if function['results'] == [type]]
+        if type == 'int':
+            candidates.append({'name' : 'len', 'params' : ['string'], 'results' : ['int'], 'bounds' : [None]})
+            if 'float2int' in builtins:
+                candidates.append({'name' : 'float2int', 'params' : ['float64'], 'results' : ['int'], 'bounds' : [None]})
+        if type == 'float64' and 'int2float' in builtins:
+            candidates.append({'name' : 'int2float', 'params' : ['int'], 'results' : ['float64'], 'bounds' : [None]})
+        if candidates == []:
+            return None
+        function = rng.choice(candidates)
+        arguments = Arguments(function, depth - 1)
+        bound = function['bounds'][0] if function['bounds'][0] is not None else arguments[0][1]
+        return (function['name'] + '(' + ', '.join(argument[0] for argument in arguments) + ')', bound, 3, False)
+
+    # Arguments of calls are terms (expressions with FUNEXP extension) that fit into bounds of parameters
+    def Arguments(function, depth):
+        arguments = []
+        for type in function['params']:
+            bound = FUZZ_PARAM_BOUNDS[type] if function['name'] not in ['len', 'float2int', 'int2float'] else FUZZ_BOUNDS[type]
+            argument = Expression(type, depth) if 'FUNEXP' in extensions else Term(type, bound)
+            if argument[1] > bound:
+                argument = Term(type, bound)
+            arguments.append(argument)
+        return arguments
+
+    def Condition(depth):
+        if 'BOOLTHEN' in extensions and depth > 0 and rng.random() < 0.3:
+            op = rng.choice(['&&', '||', '!'])
+            if op == '!':
+                operand = Condition(depth - 1)
+                return ('!' + Operand(operand, 3, False), 1, 3, operand[3])
+            precedence = -1 if op == '&&' else -2
+            left = Condition(depth - 1)
+            right = Condition(depth - 1)
+            return (Operand(left, precedence, False) + ' ' + op + ' ' + Operand(right, precedence, True), 1, precedence, left[3] and right[3])
+        if 'BOOLTHEN' in extensions and rng.random() < 0.2:
+            return Term('bool')
+        type = rng.choice(['int', 'float64', 'string'])
+        left = Expression(type, depth)
+        right = Expression(type, depth)
+        return (left[0] + ' ' + rng.choice(['==', '!=', '<', '>', '<=', '>=']) + ' ' + right[0], 1, 0, left[3] and right[3])
+
+    def Emit(indent, text):
+        lines.append('\t' * indent + text)
+
+    # Targets of assignment of given types, assignable variables (each at most once) or underscore
+    def Targets(types, bounds):
+        targets = []
+        for type, bound in zip(types, bounds):
+            variables = [(name, info) for name, info in Variables(type, True) if name not in targets]
+            if variables != [] and rng.random() < 0.8:
+                name, info = rng.choice(variables)
+                info['bound'] = max(info['bound'], bound)
+                targets.append(name)
+            else:
+                targets.append('_')
+        return targets
+
+    def Statement(indent, depth):
+        kind = rng.choice(['define', 'define', 'assign', 'assign', 'call', 'call', 'print', 'if', 'for'])
+        if kind in ['if', 'for'] and depth >= FUZZ_DEPTH:
+            kind = 'define'
+        if kind == 'assign':
+            type = rng.choice(types)
+            variables = Variables(type, True)
+            if variables == []:
+                kind = 'define'
+            elif 'MULTIVAL' in extensions and len(variables) > 1 and rng.random() < 0.3:
+                first, second = rng.sample(variables, 2)
+                values = [Expression(type, 2), Expression(type, 2)]
+                Emit(indent, first[0] + ', ' + second[0] + ' = ' + values[0][0] + ', ' + values[1][0])
+                first[1]['bound'] = max(first[1]['bound'], values[0][1])
+                second[1]['bound'] = max(second[1]['bound'], values[1][1])
+                return
+            else:
+                name, info = rng.choice(variables)
+                value = Expression(type, 2)
+                Emit(indent, name + ' = ' + value[0])
+                info['bound'] = max(info['bound'], value[1])
+                return
+        if kind == 'define':
+            type = rng.choice(types)
+            value = Expression(type, 2)
+            name = Name('v')
+            Emit(indent, name + ' := ' + value[0])
+            Declare(name, type, value[1])
+        elif kind == 'call':
+            candidates = [function for function in functions]
+            candidates.append({'name' : 'len', 'params' : ['string'], 'results' : ['int'], 'bounds' : [None]})
+            for name, params, results, bounds in FUZZ_BUILTINS:
+                if name in builtins:
+                    candidates.append({'name' : name, 'params' : params, 'results' : results, 'bounds' : bounds})
+            function = rng.choice(candidates)
+            if function['name'] == 'chr':
+                # Characters above 127 are encoded to two bytes by go
+                arguments = [Literal('int', True) if rng.random() < 0.5 else (str(rng.randint(32, 126)), 126, 3, True)]
+            else:
+                arguments = Arguments(function, 1)
+            call = function['name'] + '(' + ', '.join(argument[0] for argument in arguments) + ')'
+            bounds = [bound if bound is not None else arguments[0][1] for bound in function['bounds']]
+            if function['results'] == []:
+                Emit(indent, call)
+            else:
+                Emit(indent, ', '.join(Targets(function['results'], bounds)) + ' = ' + call)
+        elif kind == 'print':
+            Emit(indent, 'print(' + ', '.join(Term(rng.choice(types))[0] for i in range(rng.randint(1, 3))) + ', "\\n")')
+        elif kind == 'if':
+            Emit(indent, 'if ' + Condition(1)[0] + ' {')
+            Block(indent + 1, depth + 1, rng.randint(1, 4))
+            if 'BOOLTHEN' in extensions and rng.random() < 0.3:
+                Emit(indent, '}')
+                return
+            Emit(indent, '} else {')
+            Block(indent + 1, depth + 1, rng.randint(1, 4))
+            Emit(indent, '}')
+        else:
+            counter = Name('i')
+            count = rng.randint(0, 4)
+            Emit(indent, 'for ' + counter + ' := 0; ' + counter + ' < ' + str(count) + '; ' + counter + ' = ' + counter + ' + 1 {')
+            scopes.append({})
+            state['loops'] += 1
+            Declare(counter, 'int', count, True)
+            Block(indent + 1, depth + 1, rng.randint(1, 4))
+            state['loops'] -= 1
+            scopes.pop()
+            Emit(indent, '}')
+
+    # Variables of every block are printed at its end (so they are used and their values are checked)
+    def Block(indent, depth, count, results=None):
+        scopes.append({})
+        for i in range(count):
+            Statement(indent, depth)
+        names = [name for name in sorted(scopes[-1].keys()) if not scopes[-1][name]['counter']]
+        if names != []:
+            Emit(indent, 'print(' + ', '.join(name + ', " "' for name in names) + ', "\\n")')
+        bounds = []
+        if results is not None:
+            values = [Expression(type, 2) for type in results]
+            bounds = [value[1] for value in values]
+            Emit(indent, 'return' + (' ' + ', '.join(value[0] for value in values) if values != [] else ''))
+        scopes.pop()
+        return bounds
+
+    lines.append('package main')
+    for i in range(rng.randint(0, FUZZ_FUNCTIONS)):
+        name = Name('f')
+        params = [rng.choice(types) for j in range(rng.randint(0, 3))]
+        results = [rng.choice(types) for j in range(rng.randint(0, 2))]
+        names = [Name('p') for type in params]
+        lines.append('')
+        lines.append('func ' + name + '(' + ', '.join(param + ' ' + type for param, type in zip(names, params)) + ')' + (' (' + ', '.join(results) + ')' if results != [] else '') + ' {')
+        scopes.append({})
+        for param, type in zip(names, params):
+            Declare(param, type, FUZZ_PARAM_BOUNDS[type])
+        bounds = Block(1, 0, rng.randint(1, 5), results if results != [] else None)
+        scopes.pop()
+        lines.append('}')
+        functions.append({'name' : name, 'params' : params, 'results' : results, 'bounds' : bounds})
+    lines.append('')
+    lines.append('func main() {')
+    Block(1, 0, rng.randint(3, 12))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+# Random program written to a test file with header requiring implemented extensions
+def FuzzTest(seed, directory, builtins, args):
+    header = '// random program generated by testsuite.py fuzz --fuzz-seed ' + str(seed) + '\n'
+    if args.extensions != []:
+        header += '//extensions+ ' + ' '.join(args.extensions) + '\n'
+    header += '//\n'
+    code = GenerateProgram(seed, args.extensions, builtins)
+    path = os.path.join(directory, 'fuzz_' + str(seed) + '.go')
+    with open(path, 'w') as f:
+        f.write(header + code)
+    return {'name' : path,
+            'path' : path,
+            'code_offset' : len(header),
+            'code_hash' : hashlib.sha256(code).hexdigest(),
+            'nogo' : False,
+            'compiler' : [0],
+            'interpret' : [0],
+            'extensions+' : list(args.extensions),
+            'extensions-' : [],
+            'normalize' : [],
+            'input_file' : None}
+
+# Fuzz mode, random programs are run as tests in rounds and failing programs are saved to fuzz directory, returns number of failing programs
+def RunFuzz(args):
+    builtins = set(re.findall(r'^func\s+([A-Za-z_][A-Za-z_0-9]*)', args.go_include_code, re.M))
+    directory = os.path.join(args.tmp_dir, TMP_FUZZ_DIR)
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+    if not os.path.isdir(args.fuzz_dir):
+        os.makedirs(args.fuzz_dir)
+    # Go programs and outputs of random programs are never used again, so they are not kept in cache directory
+    args.cache_dir = tempfile.mkdtemp(prefix=TMP_FUZZ_CACHE_PREFIX, dir=args.tmp_dir)
+    os.mkdir(os.path.join(args.cache_dir, CACHE_GO_BINARY_DIR))
+    print('running random programs from seed ' + str(args.fuzz_seed))
+    OpenLog(args)
+    pool = None
+    run = 0
+    failed = 0
+    start = time.time()
+    try:
+        while args.fuzz_count == 0 or run < args.fuzz_count:
+            count = FUZZ_ROUND if args.fuzz_count == 0 else min(FUZZ_ROUND, args.fuzz_count - run)
+            tests = [FuzzTest(args.fuzz_seed + run + i, directory, builtins, args) for i in range(count)]
+            if pool is None:
+                ProbeToolchains(tests, args)
+                if args.jobs > 1:
+                    pool = multiprocessing.Pool(args.jobs, InitWorker, (args,))
+            if args.go_batch > 0 and args.mode_all:
+                RunGoBatch(tests, args)
+            groups = [[(run + i + 1, test)] for i, test in enumerate(tests)]
+            if pool is not None:
+                results = itertools.chain.from_iterable(pool.imap(ExecuteGroupInWorker, groups))
+            else:
+                results = itertools.chain.from_iterable(ExecuteGroup(group, args) for group in groups)
+            for test in tests:
+                verdict, messages, record = next(results)
+                if verdict in FAILURE_VERDICTS:
+                    saved = os.path.join(args.fuzz_dir, os.path.basename(test['path']))
+                    shutil.copyfile(test['path'], saved)
+                    FlushLog(messages)
+                    print(saved + ': ' + verdict)
+                    failed = failed + 1
+                os.remove(test['path'])
+            run += count
+            print('random programs run: ' + str(run) + ', failed: ' + str(failed) + ' (%.1f programs/s)' % (run / (time.time() - start)))
+    except KeyboardInterrupt:
+        print('\nrunning random programs stopped')
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        CloseInterpreterPool()
+        FlushSavedIfjcode()
+        CloseLog()
+    return failed
+
+# Median, 95th percentile and 95% confidence interval of median (from order statistics) of measured times
+def Statistics(samples):
+    samples = sorted(samples)
+    count = len(samples)
+    spread = 1.96 * math.sqrt(count) / 2
+    low = max(int(math.floor(count / 2.0 - spread)), 0)
+    high = min(int(math.ceil(count / 2.0 + spread)), count - 1)
+    if count % 2 == 1:
+        median = samples[count // 2]
+    else:
+        median = (samples[count // 2 - 1] + samples[count // 2]) / 2.0
+    return {'median' : median,
+            'p95' : samples[int(math.ceil(0.95 * count)) - 1],
+            'ci_low' : samples[low],
+            'ci_high' : samples[high],
+            'runs' : count}
+
+def FormatStatistics(stats):
+    return 'median %.2f ms, p95 %.2f ms, 95%% CI %.2f - %.2f ms' % (stats['median'] * 1000, stats['p95'] * 1000, stats['ci_low'] * 1000, stats['ci_high'] * 1000)
+
+# Number of instructions executed by ifjcode interpreter (counted from its debug output as it is read)
+def CountInstructions(input_data, program_input, tmp_dir, interpret, timeout):
+    marker = 'Executing instruction:'
+    counter = {'count' : 0, 'tail' : ''}
+    def Count(chunk):
+        # Marker may be split between chunks
+        data = counter['tail'] + chunk
+        counter['count'] += data.count(marker)
+        counter['tail'] = data[-(len(marker) - 1):]
+    ExecuteProgram([interpret, '-v'], input_data, program_input, timeout, tmp_dir, Count)
+    return counter['count']
+
+# Run stage of a test repeatedly and return statistics of measured runs together with the last result
+def MeasureStage(stage, run, args):
+    global testStages
+    times = []
+    for i in range(args.benchmark_warmup + args.benchmark_runs):
+        testStages = {}
+        info = run()
+        if i >= args.benchmark_warmup:
+            times.append(testStages[stage]['wall_time'])
+    return Statistics(times), info
+
+def BenchmarkTest(index, test, args):
+    global test_index
+    global test_id
+    test_index = index
+    test_id = test['name']
+    Log('\n********************\nBENCHMARK ' + str(test_index) + ': ' + test_id + '\n********************\n')
+    if not CheckExtensions(test['extensions+'], test['extensions-'], args.extensions):
+        Log('SKIPED')
+        return None
+    test = LoadTest(test)
+    result = {}
+    result['compiler'], compiler_info = MeasureStage('compiler', lambda: RunIfjcomp(test['code'], args.compiler, args.timeout_compile), args)
+    CheckCompilerError(compiler_info, test['compiler'])
+    Log('Compiler: ' + FormatStatistics(result['compiler']))
+    if compiler_info['exit_code'] == 0 and not args.mode_compile_only:
+        result['interpreter'], interpret_info = MeasureStage('interpreter', lambda: RunInterpreter(compiler_info['stdout'], test['input'], args), args)
+        CheckInterpretError(interpret_info, test['interpret'])
+        Log('Interpreter: ' + FormatStatistics(result['interpreter']))
+        # Interpreter with debug output is much slower, measured times are kept even if it does not finish in time
+        try:
+            result['instructions'] = CountInstructions(compiler_info['stdout'], test['input'], args.tmp_dir, args.ifjcode_interpreter, args.timeout_interpret)
+            Log('Executed instructions: ' + str(result['instructions']))
+        except TestTimeout:
+            Log('WARNING: Executed instructions were not counted, interpreter with debug output did not finish in time.')
+    return result
+
+# Slowdown is reported only if it exceeds threshold and confidence intervals of both measurements do not overlap
+def CompareBenchmark(result, baseline, args):
+    regressions = []
+    limit = 1 + args.benchmark_threshold / 100.0
+    for stage in ['compiler', 'interpreter']:
+        if stage not in result or stage not in baseline:
+            continue
+        if result[stage]['median'] > baseline[stage]['median'] * limit and result[stage]['ci_low'] > baseline[stage]['ci_high']:
+            regressions.append(stage + ' median %.2f ms is %.0f%% slower than baseline %.2f ms' % (result[stage]['median'] * 1000, (result[stage]['median'] / baseline[stage]['median'] - 1) * 100, baseline[stage]['median'] * 1000))
+    if 'instructions' in result and 'instructions' in baseline and result['instructions'] > baseline['instructions'] * limit:
+        regressions.append('executed instructions ' + str(result['instructions']) + ' against ' + str(baseline['instructions']) + ' in baseline')
+    return regressions
+
+# Benchmark mode, returns number of tests slower than baseline or failed
+def RunBenchmark(tests, args):
+    global logBuffer
+    baseline = {}
+    if args.benchmark_baseline is not None:
+        with open(args.benchmark_baseline, 'r') as f:
+            baseline = json.load(f)
+    results = {}
+    failed = 0
+    for index, test in zip(range(1, len(tests) + 1), tests):
+        logBuffer = []
+        try:
+            result = BenchmarkTest(index, test, args)
+        except Exception as error:
+            # Errors of checks and stages are already logged
+            if not any(message.startswith('ERROR: ') for message in logBuffer):
+                Log('ERROR: ' + str(error))
+            FlushLog(logBuffer)
+            print(test['name'] + ': FAILED')
+            failed = failed + 1
+            continue
+        if result is None:
+            FlushLog(logBuffer)
+            print(test['name'] + ': SKIPED')
+            continue
+        results[test['name']] = result
+        regressions = CompareBenchmark(result, baseline[test['name']], args) if test['name'] in baseline else []
+        for regression in regressions:
+            Log('REGRESSION: ' + regression)
+        FlushLog(logBuffer)
+        print(test['name'] + ': ' + ('SLOWER' if regressions != [] else 'MEASURED'))
+        for stage in ['compiler', 'interpreter']:
+            if stage in result:
+                print('    ' + stage + ': ' + FormatStatistics(result[stage]))
+        if 'instructions' in result:
+            print('    instructions: ' + str(result['instructions']))
+        for regression in regressions:
+            print('    REGRESSION: ' + regression)
+        if regressions != []:
+            failed = failed + 1
+    if args.benchmark_save is not None:
+        with open(args.benchmark_save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    return failed
+
+# Run given tests (pairs of index and test) and print their results and summary, total is number of all selected tests
+def RunTests(indexed, total, args):
+    OpenLog(args)
+    report = OpenReport(args)
+    shardFile = OpenShardFile(args, len(indexed), total)
+    fingerprints = {}
+    unchanged = set()
+    if args.incremental:
+        state = LoadIncrementalState(args)
+        runFingerprint = RunFingerprint(args)
+        for _, test in indexed:
+            fingerprints[test['name']] = TestFingerprint(test, runFingerprint)
+            previous = state.get(test['name'])
+            # Failed tests (and tests with timeout) are always run again
+            if not args.force and previous is not None and previous[0] == fingerprints[test['name']] and previous[1] in ['PASSED', 'SKIPED']:
+                unchanged.add(test['name'])
+        print('Tests unchanged since last run: \'' + str(len(unchanged)) + '\'\n')
+    jobs = [(index, test) for index, test in indexed if test['name'] not in unchanged]
+    if args.go_batch > 0 and args.mode_all and not args.no_go_needed:
+        RunGoBatch([test for _, test in jobs], args)
+    # Scenarios of the same test follow each other, they are grouped so their code is compiled only once
+    groups = []
+    for job in jobs:
+        if groups != [] and groups[-1][-1][1]['code_hash'] == job[1]['code_hash']:
+            groups[-1].append(job)
+        else:
+            groups.append([job])
+    history = LoadHistory(args)
+    if args.prioritize:
+        groups = PrioritizeGroups(groups, history, args)
+    # Unchanged tests are reported first, other tests in the order of groups
+    order = [(index, test) for index, test in indexed if test['name'] in unchanged]
+    order += [job for group in groups for job in group]
+    pool = None
+    if args.jobs > 1:
+        # Results are collected in order of groups, so output and log do not depend on scheduling
+        pool = multiprocessing.Pool(args.jobs, InitWorker, (args,))
+        results = itertools.chain.from_iterable(pool.imap(ExecuteGroupInWorker, groups))
+    else:
+        results = itertools.chain.from_iterable(ExecuteGroup(group, args) for group in groups)
+    passed = 0
+    failed = 0
+    timeout = 0
+    outputLimited = 0
+    skiped = 0
+    notRun = 0
+    measured = []
+    for index, test in order:
+        if args.max_failures > 0 and failed + timeout + outputLimited >= args.max_failures:
+            notRun = notRun + 1
+            continue
+        if test['name'] in unchanged:
+            verdict = state[test['name']][1]
+            messages = ['\n********************\nTEST ' + str(index) + ': ' + test['name'] + '\n********************\n',
+                        'test not run, it is unchanged since its last run',
+                        'LAST RESULT: ' + verdict]
+            if logEnable:
+                FlushLog(messages)
+            print(test['name'] + ': ' + verdict + ' (unchanged)')
+            record = ReportRecord(index, test, verdict, None, {})
+            record['unchanged'] = True
+        else:
+            verdict, messages, record = next(results)
+            FlushLog(messages)
+            print(test['name'] + ': ' + verdict)
+            UpdateHistory(history, record)
+            measured.append(record)
+            if args.incremental:
+                state[test['name']] = [fingerprints[test['name']], verdict]
+        if verdict == 'PASSED':
             passed = passed + 1
-            print(test['name'] + ': PASSED')
+        elif verdict == 'FAILED':
+            failed = failed + 1
+        elif verdict == 'TIMEOUT':
+            timeout = timeout + 1
+        elif verdict == 'OUTPUT_LIMIT':
+            outputLimited = outputLimited + 1
         else:
             skiped = skiped + 1
-            print(test['name'] + ': SKIPED')
-if log is not None:
-    log.close()
+        WriteReport(report, args, record)
+        WriteShardFile(shardFile, record, messages)
+    if pool is not None:
+        if notRun > 0:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    CloseInterpreterPool()
+    FlushSavedIfjcode()
+    SaveHistory(args, history)
+    if args.incremental:
+        SaveIncrementalState(args, state)
+    CloseLog()
+    CloseReport(report, args)
+    if shardFile is not None:
+        shardFile.close()
+
+    print('\n-------- SUMMARY --------\n')
+    print('PASSED: ' + str(passed))
+    print('FAILED: ' + str(failed))
+    print('TIMEOUT: ' + str(timeout))
+    print('OUTPUT_LIMIT: ' + str(outputLimited))
+    print('SKIPED: ' + str(skiped))
+    if notRun > 0:
+        print('NOT RUN: ' + str(notRun) + ' (stopped after ' + str(args.max_failures) + ' failures)')
+    PrintTopTests(measured, args.top)
+
+# Files whose changes may change results of tests (path -> modification time and size, None if the file does not exist)
+def WatchedFiles(tests, args):
+    paths = [args.compiler, args.ifjcode_interpreter, args.go_include_file]
+    for item in args.select:
+        if os.path.isdir(item):
+            for directory, _, files in os.walk(item):
+                paths += [os.path.join(directory, f) for f in files]
+        else:
+            paths.append(item)
+    paths += [test['input_file'] for test in tests if test['input_file'] is not None]
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            files[path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            files[path] = None
+    return files
+
+# Watch mode, toolchains checked at start and test index are reused, only tests whose fingerprint changed are run again
+def Watch(tests, args):
+    runFingerprint = RunFingerprint(args)
+    fingerprints = dict((test['name'], TestFingerprint(test, runFingerprint)) for test in tests)
+    files = WatchedFiles(tests, args)
+    while True:
+        print('\nwatching compiler, interpreter and tests for changes (press Ctrl+C to stop)')
+        current = files
+        while current == files:
+            time.sleep(WATCH_INTERVAL)
+            current = WatchedFiles(tests, args)
+        # Files may still be written (compiler is linked, editor saves test), wait until they stop changing
+        while current != files:
+            files = current
+            time.sleep(WATCH_INTERVAL)
+            current = WatchedFiles(tests, args)
+        if files[args.compiler] is None:
+            print('compiler \'' + args.compiler + '\' does not exist')
+            continue
+        args.compiler_fingerprint = FileFingerprint(args.compiler)
+        if files[args.go_include_file] is not None:
+            with open(args.go_include_file, 'r') as f:
+                args.go_include_code = f.read()
+            if os.path.isfile(os.path.join(args.tmp_dir, TMP_TEMPLATE_FILE_NAME)):
+                os.remove(os.path.join(args.tmp_dir, TMP_TEMPLATE_FILE_NAME))
+        try:
+            tests = ProcessTests(args)
+            ProbeToolchains(tests, args)
+        except Exception as ex:
+            print('tests can not be processed: ' + str(ex))
+            continue
+        files = WatchedFiles(tests, args)
+        runFingerprint = RunFingerprint(args)
+        previous = fingerprints
+        fingerprints = dict((test['name'], TestFingerprint(test, runFingerprint)) for test in tests)
+        indexed = [(index, test) for index, test in zip(range(1, len(tests) + 1), tests) if previous.get(test['name']) != fingerprints[test['name']]]
+        print('Tests affected by changes: \'' + str(len(indexed)) + '\'')
+        if indexed != []:
+            print('\n-------- RESULTS --------\n')
+            RunTests(indexed, len(tests), args)
+
+# Main program
+
+if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+    MergeShards(ParseMergeArgs())
+    sys.exit(0)
+args = ParseArgs(sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ['reduce', 'fuzz'] else None)
+argsTime = time.time()
+tests = ProcessTests(args) if args.command != 'fuzz' else []
+testsTime = time.time()
+ProbeToolchains(tests, args)
+if args.verbose:
+    end = time.time()
+    print('startup took %.1f ms (arguments %.1f ms, tests %.1f ms, toolchains %.1f ms)' % ((end - startTime) * 1000, (argsTime - startTime) * 1000, (testsTime - argsTime) * 1000, (end - testsTime) * 1000))
+print('\n-------- RESULTS --------\n')
+outputLimit = args.max_output * 1024 * 1024
+stageLimits = StageLimits(args)
+if args.benchmark:
+    OpenLog(args)
+    failed = RunBenchmark(tests, args)
+    CloseLog()
+    if os.path.isdir(args.tmp_dir):
+        shutil.rmtree(args.tmp_dir)
+    print('\n-------- SUMMARY --------\n')
+    print('SLOWER OR FAILED: ' + str(failed))
+    sys.exit(1 if failed > 0 else 0)
+if args.command == 'reduce':
+    ReduceTest(tests, args)
+    if os.path.isdir(args.tmp_dir):
+        shutil.rmtree(args.tmp_dir)
+    sys.exit(0)
+if args.command == 'fuzz':
+    failed = RunFuzz(args)
+    if os.path.isdir(args.tmp_dir):
+        shutil.rmtree(args.tmp_dir)
+    print('\n-------- SUMMARY --------\n')
+    print('FAILED: ' + str(failed))
+    sys.exit(1 if failed > 0 else 0)
+# Indexes of tests are kept from the whole selection, so logs of shards can be merged in order
+indexed = list(zip(range(1, len(tests) + 1), tests))
+if args.shard is not None:
+    shardTests = ShardTests(tests, args)
+    indexed = [(index, test) for index, test in indexed if test['name'] in shardTests]
+    print('Tests in shard ' + str(args.shard) + '/' + str(args.shards) + ': \'' + str(len(indexed)) + '\'\n')
+RunTests(indexed, len(tests), args)
+if args.watch:
+    try:
+        Watch(tests, args)
+    except KeyboardInterrupt:
+        print('\nwatching stopped')
+        CloseInterpreterPool()
+        FlushSavedIfjcode()
 if os.path.isdir(args.tmp_dir):
     shutil.rmtree(args.tmp_dir)
-
-print('\n-------- SUMMARY --------\n')
-print('PASSED: ' + str(passed))
-print('FAILED: ' + str(failed))
-print('SKIPED: ' + str(skiped))